@@ -17,7 +17,12 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 __all__=['version']
-from ._version import get_versions
-__version__ = get_versions()['version']
-del get_versions
-version = __version__
+
+def __getattr__(name):
+    # the version lookup can shell out to git, so only do it when asked for
+    if name in ('version', '__version__'):
+        from ._version import get_versions
+        version = get_versions()['version']
+        globals().update(version = version, __version__ = version)
+        return version
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+
+# BMS Tools
+# Copyright (C) 2020 Eric Poulsen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Alarm rules evaluated against readBasicInfo() / readCellInfo() samples.
+#
+#   e = AlarmEngine(['cell_delta > 50 mV for 30 s',
+#                    'any ntc > 45 C hysteresis 2',
+#                    'fault_raw bit 3',
+#                    'covp_err'])
+#   e.subscribe(lambda alarm: print(alarm))
+#   e.update('rack1', basicInfo, cellInfo)
+#
+# A rule is
+#
+#   [any|all|max|min|avg] metric [bit N | & mask] [op value [unit]]
+#       [for N s|min|h] [hysteresis N [unit]]
+#
+# metric is any readBasicInfo() value, cellN_mv, cell_min, cell_max,
+# cell_avg, cell_delta, or the groups 'cell' and 'ntc' (all cell mV / all
+# NTC temperatures, 'any' unless a quantifier is given).  Without op the
+# value is tested for truth.  Units scale the value: V, A and Ah are
+# multiplied by 1000 to match the mV / mA / mAh the BMS reports.
+#
+# 'for' debounces: the condition has to hold that long before the alarm
+# is raised.  'hysteresis' relaxes the threshold while the alarm is
+# active, so a value hovering at the threshold doesn't toggle it.
+#
+# Rules are parsed once into closures; per sample the derived values are
+# computed once and each rule is a call or two.  State is kept per pack;
+# pass None as the pack when there is only one.
+
+import re
+import time
+import operator
+
+__all__ = ['Rule', 'Alarm', 'AlarmEngine']
+
+_ops = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le,
+        '==': operator.eq, '!=': operator.ne}
+_units = {'mv': 1, 'v': 1000, 'ma': 1, 'a': 1000, 'mah': 1, 'ah': 1000,
+          'c': 1, '%': 1, 'mohm': 1}
+_seconds = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600}
+_groups = {'cell': 'cells', 'ntc': 'ntcs'}
+_aggregates = {'max': max, 'min': min, 'avg': lambda v: sum(v) / len(v)}
+_derived = {'cell_min', 'cell_max', 'cell_avg', 'cell_delta'}
+
+_number = r'-?(?:0x[0-9a-f]+|\d+(?:\.\d+)?)'
+_ruleRE = re.compile(rf'''
+    (?:(?P<quant>any|all|max|min|avg)\s+)?
+    (?P<metric>[a-z_][a-z0-9_]*)
+    (?:\s+bit\s+(?P<bit>\d+)|\s*&\s*(?P<mask>{_number}))?
+    (?:\s*(?P<op>>=|<=|==|!=|>|<)\s*(?P<value>{_number})\s*(?P<unit>[a-z%]+)?)?
+    (?P<options>(?:\s+(?:for|hyst|hysteresis)\s+{_number}\s*[a-z%]*)*)
+    ''', re.X | re.I)
+_optionRE = re.compile(rf'(for|hyst|hysteresis)\s+({_number})\s*([a-z%]*)', re.I)
+
+def _num(s):
+    return int(s, 16) if s.lower().startswith(('0x', '-0x')) else float(s)
+
+def _scale(value, unit, text):
+    if not unit: return value
+    try:
+        return value * _units[unit.lower()]
+    except KeyError:
+        raise ValueError(f'{text!r}: unknown unit {unit!r}') from None
+
+class Rule:
+    '''one compiled rule.  test(ctx, active) returns (condition, value) for
+    a context built by AlarmEngine.context()'''
+    def __init__(self, text, name = None, level = 'warning'):
+        self.text = text.strip()
+        self.name = name or self.text
+        self.level = level
+        m = _ruleRE.fullmatch(self.text)
+        if not m:
+            raise ValueError(f'cannot parse alarm rule {text!r}')
+        self.forSeconds = 0
+        hyst = 0
+        for kind, n, unit in _optionRE.findall(m.group('options')):
+            if kind.lower() == 'for':
+                try:
+                    self.forSeconds = _num(n) * _seconds[(unit or 's').lower()]
+                except KeyError:
+                    raise ValueError(f'{text!r}: unknown time unit {unit!r}') from None
+            else:
+                hyst = _scale(_num(n), unit, text)
+        self.test = self._compile(m, hyst)
+
+    def _compile(self, m, hyst):
+        text = self.text
+        quant, metric = (m.group('quant') or '').lower(), m.group('metric').lower()
+
+        # value getter
+        if metric in _groups:
+            key = _groups[metric]
+            quant = quant or 'any'
+            get = lambda ctx: ctx[key]
+        else:
+            if quant:
+                raise ValueError(f'{text!r}: {quant} needs a group (cell, ntc), not {metric!r}')
+            if not (metric in _derived or re.fullmatch(r'cell\d+_mv', metric)
+                    or metric in _knownValues()):
+                raise ValueError(f'{text!r}: unknown value {metric!r}')
+            get = lambda ctx: ctx.get(metric)
+
+        if m.group('bit') is not None:
+            bit = int(m.group('bit'))
+            get = (lambda g: lambda ctx: None if g(ctx) is None else (int(g(ctx)) >> bit) & 1)(get)
+        elif m.group('mask') is not None:
+            mask = int(_num(m.group('mask')))
+            get = (lambda g: lambda ctx: None if g(ctx) is None else int(g(ctx)) & mask)(get)
+
+        # single value predicate; pass = the relaxed test while active
+        op = m.group('op')
+        if op is None:
+            cmp = lambda v, active: bool(v)
+        else:
+            fn = _ops[op]
+            limit = _scale(_num(m.group('value')), m.group('unit'), text)
+            relaxed = {'>': -hyst, '>=': -hyst, '<': hyst, '<=': hyst}.get(op, 0)
+            held = limit + relaxed
+            cmp = lambda v, active: fn(v, held if active else limit)
+
+        if quant in _aggregates:
+            agg = _aggregates[quant]
+            def test(ctx, active):
+                values = [v for v in get(ctx) if v is not None]
+                if not values: return False, None
+                v = agg(values)
+                return cmp(v, active), v
+        elif quant in ('any', 'all'):
+            q = any if quant == 'any' else all
+            pick = min if op in ('<', '<=') else max
+            def test(ctx, active):
+                values = [v for v in get(ctx) if v is not None]
+                if not values: return False, None
+                return q(cmp(v, active) for v in values), pick(values)
+        else:
+            def test(ctx, active):
+                v = get(ctx)
+                if v is None: return False, None
+                return cmp(v, active), v
+        return test
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}: {self.name!r}>'
+
+_known = None
+def _knownValues():
+    global _known
+    if _known is None:
+        from .registers import BasicInfoReg
+        _known = set(BasicInfoReg._valueNames)
+    return _known
+
+class Alarm:
+    'an alarm raised (active = True) or cleared (active = False)'
+    __slots__ = ('rule', 'pack', 't', 'value', 'active')
+
+    def __init__(self, rule, pack, t, value, active):
+        self.rule, self.pack, self.t, self.value, self.active = rule, pack, t, value, active
+
+    def __repr__(self):
+        state = 'raised' if self.active else 'cleared'
+        pack = '' if self.pack is None else f' pack {self.pack}'
+        return f'<{self.__class__.__name__}: {self.rule.level} {self.rule.name!r}{pack} {state} at {self.value}>'
+
+class AlarmEngine:
+    'evaluates Rules per pack and calls subscribers on changes; see the module comment'
+    def __init__(self, rules = ()):
+        self.rules = []
+        self.callbacks = []
+        self.state = {} # pack: [[active, pending since], ...] per rule
+        for rule in rules:
+            self.add(rule)
+
+    def add(self, rule, name = None, level = 'warning'):
+        'add a Rule or rule text; returns the Rule'
+        if not isinstance(rule, Rule):
+            rule = Rule(rule, name, level)
+        self.rules.append(rule)
+        for st in self.state.values():
+            st.append([False, None])
+        return rule
+
+    def subscribe(self, callback):
+        'callback(alarm) is called for every raised and cleared Alarm'
+        self.callbacks.append(callback)
+
+    @staticmethod
+    def context(basicInfo, cellInfo):
+        'return the values rules are evaluated against'
+        cellInfo = cellInfo or {}
+        ctx = dict(basicInfo)
+        ctx.update(cellInfo)
+        cells = [v for v in cellInfo.values() if v is not None]
+        ctx['cells'] = cells
+        ctx['ntcs'] = [basicInfo.get(f'ntc{i}') for i in range(basicInfo.get('ntc_cnt') or 0)]
+        if cells:
+            ctx['cell_min'], ctx['cell_max'] = lo, hi = min(cells), max(cells)
+            ctx['cell_avg'] = sum(cells) / len(cells)
+            ctx['cell_delta'] = hi - lo
+        return ctx
+
+    def update(self, pack, basicInfo, cellInfo = None, t = None):
+        'evaluate all rules for one sample; returns the Alarms raised or cleared'
+        t = time.monotonic() if t is None else t
+        ctx = self.context(basicInfo, cellInfo)
+        st = self.state.get(pack)
+        if st is None:
+            st = self.state[pack] = [[False, None] for _ in self.rules]
+        changes = []
+        for rule, s in zip(self.rules, st):
+            ok, value = rule.test(ctx, s[0])
+            if s[0]:
+                if not ok:
+                    s[0], s[1] = False, None
+                    changes.append(Alarm(rule, pack, t, value, False))
+            elif ok:
+                if s[1] is None: s[1] = t
+                if t - s[1] >= rule.forSeconds:
+                    s[0] = True
+                    changes.append(Alarm(rule, pack, t, value, True))
+            else:
+                s[1] = None
+        for alarm in changes:
+            for cb in self.callbacks:
+                cb(alarm)
+        return changes
+
+    def active(self, pack = None):
+        'return the active Rules for pack'
+        return [rule for rule, s in zip(self.rules, self.state.get(pack, ())) if s[0]]
+
+    def reset(self, pack = None):
+        self.state.pop(pack, None)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+# BMS Tools
+# Copyright (C) 2020 Eric Poulsen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Cross-pack outlier detection for fleets of identical packs.
+#
+#   d = FleetAnomalies()
+#   d.update('rack1', basicInfo, cellInfo)   # as each pack is polled
+#   for a in d.tick(): print(a)               # once per poll round
+#
+# update() reduces a sample to a few per-pack metrics (see metrics) and
+# keeps only the latest.  tick() takes, per metric, the median and the
+# median absolute deviation (MAD) across packs and flags packs whose
+# robust z-score, 0.6745 * (x - median) / MAD, exceeds threshold.  The
+# MAD is floored at minScale so a tight, healthy fleet doesn't flag
+# packs for a millivolt.  With perCell, cell N of each pack is also
+# compared against cell N of the others.
+#
+# Medians use numpy.partition (linear) if NumPy is installed, else a sort.
+
+import time
+
+from .optional import numpy as _numpy
+
+__all__ = ['FleetAnomalies', 'Anomaly']
+
+# metric: MAD floor, in the metric's unit
+minScale = {
+    'cell_min_mv': 5, 'cell_max_mv': 5, 'cell_avg_mv': 5, 'cell_delta_mv': 5,
+    'pack_ma': 200, 'ntc_max': .5, 'ntc_avg': .5,
+}
+cellMinScale = 5
+
+def _median(values, np):
+    n = len(values)
+    if np is not None:
+        a = np.asarray(values, dtype = np.float64)
+        if n % 2:
+            return float(np.partition(a, n // 2)[n // 2])
+        p = np.partition(a, (n // 2 - 1, n // 2))
+        return float(p[n // 2 - 1] + p[n // 2]) / 2
+    s = sorted(values)
+    return s[n // 2] if n % 2 else (s[n // 2 - 1] + s[n // 2]) / 2
+
+class Anomaly:
+    'pack deviates from the fleet on metric by score robust standard deviations'
+    __slots__ = ('pack', 'metric', 'value', 'median', 'mad', 'score', 't')
+
+    def __init__(self, pack, metric, value, median, mad, score, t):
+        self.pack, self.metric, self.value = pack, metric, value
+        self.median, self.mad, self.score, self.t = median, mad, score, t
+
+    def __repr__(self):
+        return (f'<{self.__class__.__name__}: pack {self.pack} {self.metric} {self.value} '
+                f'vs median {self.median} (score {self.score:+.1f})>')
+
+class FleetAnomalies:
+    '''cross-pack median / MAD outlier detector; see the module comment.
+    Packs not updated within maxAge seconds are left out of a tick.  A pack
+    is reported after being an outlier on a metric for minTicks ticks in a
+    row.'''
+    def __init__(self, threshold = 3.5, minPacks = 4, perCell = False,
+                 maxAge = None, minTicks = 1, scales = None):
+        self.threshold = threshold
+        self.minPacks = minPacks
+        self.perCell = perCell
+        self.maxAge = maxAge
+        self.minTicks = minTicks
+        self.scales = dict(minScale, **(scales or {}))
+        self.latest = {}   # pack: (t, {metric: value})
+        self.streaks = {}  # (pack, metric): consecutive outlier ticks
+        self.callbacks = []
+        self.stats = {}    # metric: (median, mad) from the last tick
+
+    def subscribe(self, callback):
+        'callback(anomaly) is called for each Anomaly tick() reports'
+        self.callbacks.append(callback)
+
+    def metrics(self, basicInfo, cellInfo):
+        'return {metric: value} for one sample'
+        ret = {}
+        cellInfo = cellInfo or {}
+        cells = [v for v in cellInfo.values() if v is not None]
+        if cells:
+            lo, hi = min(cells), max(cells)
+            ret['cell_min_mv'], ret['cell_max_mv'] = lo, hi
+            ret['cell_avg_mv'] = sum(cells) / len(cells)
+            ret['cell_delta_mv'] = hi - lo
+            if self.perCell:
+                ret.update((k, v) for k, v in cellInfo.items() if v is not None)
+        if basicInfo.get('pack_ma') is not None:
+            ret['pack_ma'] = basicInfo['pack_ma']
+        temps = [basicInfo.get(f'ntc{i}') for i in range(basicInfo.get('ntc_cnt') or 0)]
+        temps = [v for v in temps if v is not None]
+        if temps:
+            ret['ntc_max'] = max(temps)
+            ret['ntc_avg'] = sum(temps) / len(temps)
+        return ret
+
+    def update(self, pack, basicInfo, cellInfo = None, t = None):
+        'record the latest sample for pack; O(cells)'
+        t = time.monotonic() if t is None else t
+        self.latest[pack] = (t, self.metrics(basicInfo, cellInfo))
+
+    def remove(self, pack):
+        self.latest.pop(pack, None)
+        for key in [k for k in self.streaks if k[0] == pack]:
+            del self.streaks[key]
+
+    def tick(self, t = None):
+        'compare the packs; returns the Anomalies found this tick'
+        t = time.monotonic() if t is None else t
+        np = _numpy()
+        columns = {} # metric: ([pack, ...], [value, ...])
+        for pack, (pt, values) in self.latest.items():
+            if self.maxAge is not None and t - pt > self.maxAge: continue
+            for metric, v in values.items():
+                packs, vals = columns.setdefault(metric, ([], []))
+                packs.append(pack)
+                vals.append(v)
+
+        found = []
+        seen = set()
+        self.stats = {}
+        for metric, (packs, vals) in columns.items():
+            if len(vals) < self.minPacks: continue
+            med = _median(vals, np)
+            mad = _median([abs(v - med) for v in vals], np)
+            self.stats[metric] = (med, mad)
+            scale = max(mad, self.scales.get(metric, cellMinScale))
+            for pack, v in zip(packs, vals):
+                score = .6745 * (v - med) / scale
+                if abs(score) <= self.threshold: continue
+                key = pack, metric
+                seen.add(key)
+                streak = self.streaks[key] = self.streaks.get(key, 0) + 1
+                if streak >= self.minTicks:
+                    found.append(Anomaly(pack, metric, v, med, mad, score, t))
+        for key in [k for k in self.streaks if k not in seen]:
+            del self.streaks[key]
+        for anomaly in found:
+            for cb in self.callbacks:
+                cb(anomaly)
+        return found
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+# BMS Tools
+# Copyright (C) 2020 Eric Poulsen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Balancing activity from bal_raw.
+#
+#   b = BalanceTracker()
+#   b.update(basicInfo)      # per sample
+#   b.summary()
+#
+# Each interval between samples is credited to the cells whose balance
+# bit was set at its start; 0 -> 1 transitions count as balancing events.
+# Only set and changed bits are visited, so a sample with no balancing
+# costs a few integer operations.  Intervals longer than maxGap are not
+# credited.
+#
+# Time to balance: when pack_ma falls from above chargeMa (charging) to
+# or below it, the charge is taken as complete; the time from then until
+# bal_raw reads 0 is recorded.  A charge that restarts first discards the
+# measurement.
+
+import time
+from collections import deque
+
+__all__ = ['BalanceTracker', 'BalanceTrackers']
+
+def _bits(x):
+    'yield the indices of the set bits of x'
+    while x:
+        low = x & -x
+        yield low.bit_length() - 1
+        x ^= low
+
+class BalanceTracker:
+    'per-cell balancing duty cycle, event counts and time to balance for one pack'
+    def __init__(self, chargeMa = 100, maxGap = 60, historyLen = 100):
+        self.chargeMa = chargeMa
+        self.maxGap = maxGap
+        self.t = None
+        self.balRaw = 0
+        self.charging = False
+        self.chargeEnd = None  # t charge completed, while waiting for balancing to stop
+        self.seconds = 0.0     # time covered
+        self.onSeconds = {}    # cell: seconds balancing
+        self.events = {}       # cell: 0 -> 1 transitions
+        self.timeToBalance = deque(maxlen = historyLen)
+        self.samples = 0
+
+    def update(self, basicInfo, cellInfo = None, t = None):
+        'add a readBasicInfo() sample taken at time t; cellInfo is not used.  Returns self.'
+        t = time.monotonic() if t is None else t
+        bal = int(basicInfo['bal_raw'])
+        last, lastT = self.balRaw, self.t
+        self.samples += 1
+        if lastT is not None:
+            dt = t - lastT
+            if dt > 0 and (self.maxGap is None or dt <= self.maxGap):
+                self.seconds += dt
+                for cell in _bits(last):
+                    self.onSeconds[cell] = self.onSeconds.get(cell, 0.0) + dt
+        if lastT is not None:
+            for cell in _bits(bal & ~last):
+                self.events[cell] = self.events.get(cell, 0) + 1
+        self.t, self.balRaw = t, bal
+
+        ma = basicInfo.get('pack_ma')
+        if ma is not None:
+            charging = ma > self.chargeMa
+            if charging:
+                self.chargeEnd = None
+            elif self.charging:
+                self.chargeEnd = t
+            self.charging = charging
+        if self.chargeEnd is not None and not bal:
+            self.timeToBalance.append(t - self.chargeEnd)
+            self.chargeEnd = None
+        return self
+
+    @property
+    def balancing(self):
+        'cells balancing as of the last sample'
+        return list(_bits(self.balRaw))
+
+    def duty(self, cell):
+        'fraction of the covered time cell was balancing'
+        return self.onSeconds.get(cell, 0.0) / self.seconds if self.seconds else 0.0
+
+    def summary(self):
+        'return a compact dict: totals, and per-cell duty / events for cells that balanced'
+        cells = sorted(set(self.onSeconds) | set(self.events))
+        ttb = self.timeToBalance
+        return {
+            'samples': self.samples,
+            'seconds': self.seconds,
+            'events': sum(self.events.values()),
+            'balancing': self.balancing,
+            'duty': {cell: self.duty(cell) for cell in cells},
+            'cell_events': {cell: self.events.get(cell, 0) for cell in cells},
+            'time_to_balance': ttb[-1] if ttb else None,
+            'time_to_balance_avg': sum(ttb) / len(ttb) if ttb else None,
+            'waiting': self.chargeEnd is not None,
+        }
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}: {self.samples} samples, {sum(self.events.values())} events>'
+
+class BalanceTrackers:
+    'BalanceTracker per pack'
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.trackers = {}
+
+    def __getitem__(self, pack):
+        tracker = self.trackers.get(pack)
+        if tracker is None:
+            tracker = self.trackers[pack] = BalanceTracker(**self.kwargs)
+        return tracker
+
+    def __iter__(self):
+        return iter(self.trackers)
+
+    def __len__(self):
+        return len(self.trackers)
+
+    def update(self, pack, basicInfo, cellInfo = None, t = None):
+        return self[pack].update(basicInfo, cellInfo, t)
+
+    def summary(self):
+        return {pack: tracker.summary() for pack, tracker in self.trackers.items()}
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+# BMS Tools
+# Copyright (C) 2020 Eric Poulsen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Vectorised decoding of recorded basic info (0x03) and cell info (0x04)
+# payloads into NumPy structured arrays.  Column names and scaling match
+# BasicInfoReg and CellInfoReg.
+#
+# NumPy is optional (pip install bmstools[numpy]); it is only imported
+# when one of these functions is called.
+
+from .registers import BasicInfoReg
+from .optional import numpy as _numpy
+
+__all__ = ['decodeBasicInfo', 'decodeCellInfo']
+
+# fixed part of the basic info payload; same layout as BasicInfoReg.unpack
+_basicHeader = [
+    ('pack_mv', '>u2'), ('pack_ma', '>i2'), ('cur_cap', '>u2'),
+    ('full_cap', '>u2'), ('cycle_cnt', '>u2'), ('date_raw', '>u2'),
+    ('bal_raw0', '>u2'), ('bal_raw1', '>u2'), ('fault_raw', '>u2'),
+    ('version', 'u1'), ('cap_pct', 'u1'), ('fet_raw', 'u1'),
+    ('cell_cnt', 'u1'), ('ntc_cnt', 'u1'),
+]
+_basicHeaderSize = 23
+_maxNtc = len(BasicInfoReg._ntcFields)
+
+def _stack(np, payloads):
+    'return payloads as a 2D uint8 array, one row per payload'
+    if isinstance(payloads, np.ndarray):
+        if payloads.ndim != 2:
+            raise ValueError('payload array must be 2D (frames x bytes)')
+        return payloads.astype(np.uint8, copy = False)
+    payloads = [bytes(p) for p in payloads]
+    if not payloads:
+        return np.zeros((0, 0), dtype = np.uint8)
+    size = len(payloads[0])
+    if any(len(p) != size for p in payloads):
+        raise ValueError('payloads must all be the same length')
+    return np.frombuffer(b''.join(payloads), dtype = np.uint8).reshape(len(payloads), size)
+
+def _basicDtype(np):
+    fields = [
+        ('pack_mv', np.int32), ('pack_ma', np.int32), ('cur_cap', np.int32),
+        ('full_cap', np.int32), ('cycle_cnt', np.uint16),
+        ('year', np.uint16), ('month', np.uint8), ('day', np.uint8),
+        *[(n, np.bool_) for n in BasicInfoReg._balBits],
+        *[(n, np.bool_) for n in BasicInfoReg._faultBits],
+        ('version', np.uint8), ('cap_pct', np.uint8),
+        *[(n, np.bool_) for n in BasicInfoReg._fetBits],
+        ('ntc_cnt', np.uint8), ('cell_cnt', np.uint8),
+        *[(n, np.float64) for n in BasicInfoReg._ntcFields],
+        ('fault_raw', np.uint32), ('bal_raw', np.uint32),
+    ]
+    assert [n for n, _ in fields] == BasicInfoReg._valueNames
+    return np.dtype(fields)
+
+def decodeBasicInfo(payloads):
+    '''decode equal-length basic info payloads into a structured array
+
+    payloads is a sequence of bytes-like objects, or a 2D uint8 array.
+    Columns match BasicInfoReg; absent NTCs are NaN rather than None.'''
+    np = _numpy('batch decoding')
+    a = _stack(np, payloads)
+    n, size = a.shape
+    out = np.zeros(n, dtype = _basicDtype(np))
+    if not n:
+        return out
+    if size < _basicHeaderSize:
+        raise ValueError(f'basic info payloads must be at least {_basicHeaderSize} bytes')
+
+    h = np.ascontiguousarray(a[:, :_basicHeaderSize]).view(np.dtype(_basicHeader)).ravel()
+    out['pack_mv'] = h['pack_mv'].astype(np.int32) * 10
+    out['pack_ma'] = h['pack_ma'].astype(np.int32) * 10
+    out['cur_cap'] = h['cur_cap'].astype(np.int32) * 10
+    out['full_cap'] = h['full_cap'].astype(np.int32) * 10
+    out['cycle_cnt'] = h['cycle_cnt']
+
+    date = h['date_raw'].astype(np.uint16)
+    out['day'] = date & 0x1f
+    out['month'] = (date >> 5) & 0xf
+    out['year'] = ((date >> 9) & 0x7f) + 2000
+
+    bal = h['bal_raw0'].astype(np.uint32) | (h['bal_raw1'].astype(np.uint32) << 16)
+    fault = h['fault_raw'].astype(np.uint32)
+    fet = h['fet_raw']
+    out['bal_raw'] = bal
+    out['fault_raw'] = fault
+    for bit, name in enumerate(BasicInfoReg._balBits):
+        out[name] = (bal >> bit) & 1
+    for bit, name in enumerate(BasicInfoReg._faultBits):
+        out[name] = (fault >> bit) & 1
+    for bit, name in enumerate(BasicInfoReg._fetBits):
+        out[name] = (fet >> bit) & 1
+
+    out['version'] = h['version']
+    out['cap_pct'] = h['cap_pct']
+    out['cell_cnt'] = h['cell_cnt']
+    out['ntc_cnt'] = h['ntc_cnt']
+
+    # NTCs, via the TempParser formula; NaN where the frame has fewer NTCs
+    ntcCols = min(_maxNtc, (size - _basicHeaderSize) // 2)
+    raw = np.ascontiguousarray(a[:, _basicHeaderSize:_basicHeaderSize + ntcCols * 2]).view('>u2')
+    temps = (raw.astype(np.float64) - 2731) / 10
+    for i, name in enumerate(BasicInfoReg._ntcFields):
+        if i < ntcCols:
+            out[name] = np.where(h['ntc_cnt'] > i, temps[:, i], np.nan)
+        else:
+            out[name] = np.nan
+    return out
+
+def decodeCellInfo(payloads):
+    '''decode equal-length cell info payloads into a structured array
+
+    Columns are cell0_mv ... cellN_mv, as in CellInfoReg.  Payloads must
+    be an even number of bytes; empty payloads give an array without
+    columns.'''
+    np = _numpy('batch decoding')
+    a = _stack(np, payloads)
+    n, size = a.shape
+    if size % 2:
+        raise ValueError('cell info payloads must be an even number of bytes')
+    cellCnt = size // 2
+    out = np.zeros(n, dtype = np.dtype([(f'cell{i}_mv', np.uint16) for i in range(cellCnt)]))
+    if not n or not cellCnt:
+        return out
+    raw = np.ascontiguousarray(a).view('>u2')
+    for i in range(cellCnt):
+        out[f'cell{i}_mv'] = raw[:, i]
+    return out
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+# BMS Tools
+# Copyright (C) 2020 Eric Poulsen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Sanity checks and benchmarks; run with `python -m bmstools.jbd.bench`
+# (or `make check`).  Exits non-zero if a check fails or a budget is blown.
+
+import subprocess
+import sys
+
+# cumulative import budgets, in milliseconds
+importBudgets = {
+    'bmstools.jbd': 45,
+    'bmstools.jbd.logging': 50,
+}
+
+# modules that must only be loaded on demand
+lazyModules = 'serial', 'xlsxwriter', 'numpy', 'subprocess'
+
+def importTime(module, runs = 5):
+    'best-of-runs cumulative import time of module in ms, via python -X importtime'
+    best = None
+    for i in range(runs):
+        p = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                           stdout = subprocess.DEVNULL, stderr = subprocess.PIPE,
+                           universal_newlines = True, check = True)
+        for line in p.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            fields = line.split('|')
+            if len(fields) != 3 or fields[2].strip() != module:
+                continue
+            ms = int(fields[1]) / 1000
+            best = ms if best is None else min(best, ms)
+    if best is None:
+        raise RuntimeError(f'no importtime data for {module}')
+    return best
+
+def checkImportTimes(budgets = importBudgets):
+    errors = []
+    for module, budget in budgets.items():
+        ms = importTime(module)
+        print(f'import {module}: {ms:.1f} ms (budget {budget} ms)')
+        if ms > budget:
+            errors.append(f'import {module} took {ms:.1f} ms, budget is {budget} ms')
+    return errors
+
+def checkLazyImports(modules = tuple(importBudgets), lazy = lazyModules):
+    errors = []
+    for module in modules:
+        code = f'import sys, {module}; print(" ".join(m for m in {lazy!r} if m in sys.modules))'
+        p = subprocess.run([sys.executable, '-c', code], stdout = subprocess.PIPE,
+                           universal_newlines = True, check = True)
+        for m in p.stdout.split():
+            errors.append(f'import {module} eagerly imports {m}')
+    return errors
+
+def checkRegs():
+    from .regmap import checkRegNames
+    return checkRegNames()
+
+def checkEnergy():
+    'coulomb counting across idle <-> discharge and zero crossing intervals'
+    from .energy import EnergyCounter
+    errors = []
+    # (mA at t = 0, mA at t = 3600) -> expected (mahIn, mahOut)
+    cases = {(0, -1000): (0, 500), (-1000, 0): (0, 500), (0, 1000): (500, 0),
+             (1000, 0): (500, 0), (1000, -1000): (250, 250), (0, 0): (0, 0)}
+    for (a, b), expected in cases.items():
+        c = EnergyCounter(maxGap = None)
+        c.add(0, 50000, a)
+        c.add(3600, 50000, b)
+        got = round(c.mahIn, 6), round(c.mahOut, 6)
+        if got != expected:
+            errors.append(f'energy {a} -> {b} mA: mAh in/out {got}, expected {expected}')
+        if (round(c.whIn * 20, 6), round(c.whOut * 20, 6)) != expected:
+            errors.append(f'energy {a} -> {b} mA: Wh in/out {c.whIn, c.whOut}, expected {expected} / 20')
+
+    # a restored checkpoint must not integrate from the saving process's clock
+    c = EnergyCounter(maxGap = None)
+    c.add(1000, 50000, -1000)
+    c.add(1004, 50000, -1000)
+    restored = EnergyCounter(maxGap = None).restore(c.checkpoint())
+    restored.add(1020, 50000, -1000)
+    if restored.mahOut != c.mahOut:
+        errors.append(f'energy restore: mAh out {restored.mahOut}, expected {c.mahOut}')
+    return errors
+
+def sampleInfo(cellCnt = 16, ntcCnt = 4):
+    'a synthetic (basicInfo, cellInfo) sample, as readBasicInfo() / readCellInfo() return them'
+    import struct
+    from .registers import BasicInfoReg, CellInfoReg
+    payload = struct.pack('>HhHHHHHHHBBBBB', 5300, -1234, 5000, 10000, 7, (21 << 9) | (3 << 5) | 14,
+                          0b101, 0, 0, 0x10, 50, 3, cellCnt, ntcCnt)
+    payload += b''.join(struct.pack('>H', 2731 + 250 + i) for i in range(ntcCnt))
+    b = BasicInfoReg('basic_info', 0x03)
+    b.unpack(payload)
+    c = CellInfoReg('cell_info', 0x04)
+    c.unpack(struct.pack(f'>{cellCnt}H', *[3300 + i for i in range(cellCnt)]))
+    return dict(b), dict(c)
+
+def logRates(rows = 20000):
+    '''return {mode: rows per second} for each Logger output mode, writing
+    rows samples through a blocking LogWriter into a temporary directory'''
+    import os
+    import time
+    import tempfile
+    from .logging import Logger, LogWriter
+    modes = {
+        'csv': ('log.csv', {}),
+        'csv raw': ('log.csv', {'raw': True}),
+        'jbl': ('log.jbl', {}),
+        'sqlite': ('log.sqlite', {}),
+    }
+    try:
+        import xlsxwriter
+        modes['xlsx'] = 'log.xlsx', {}
+        modes['xlsx raw'] = 'log.xlsx', {'raw': True}
+    except ImportError:
+        pass
+    basicInfo, cellInfo = sampleInfo()
+    ret = {}
+    with tempfile.TemporaryDirectory() as d:
+        for mode, (fn, kwargs) in modes.items():
+            fn = os.path.join(d, fn)
+            if os.path.exists(fn): os.remove(fn)
+            writer = LogWriter(queueSize = 10000, block = True)
+            logger = Logger(fn, writer, **kwargs)
+            t0 = time.time()
+            start = time.perf_counter()
+            for i in range(rows):
+                writer.put(logger, (t0 + i * .1, basicInfo, cellInfo))
+            logger.close()
+            ret[mode] = rows / (time.perf_counter() - start)
+            writer.stop()
+    return ret
+
+def main():
+    import argparse
+    p = argparse.ArgumentParser(description = 'bmstools sanity checks and benchmarks')
+    p.add_argument('--no-import-time', action='store_true', help='skip import time budget check')
+    p.add_argument('--log-rate', action='store_true', help='benchmark Logger rows per second per output mode')
+    args = p.parse_args()
+
+    if args.log_rate:
+        import contextlib, io
+        with contextlib.redirect_stdout(io.StringIO()): # Logger's open/close messages
+            rates = logRates()
+        for mode, rate in rates.items():
+            print(f'log {mode}: {rate:,.0f} rows/s')
+
+    errors = checkRegs()
+    errors += checkEnergy()
+    errors += checkLazyImports()
+    if not args.no_import_time:
+        errors += checkImportTimes()
+    for error in errors:
+        print(error, file = sys.stderr)
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+
+# BMS Tools
+# Copyright (C) 2020 Eric Poulsen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Compact append-only binary telemetry log (.jbl).
+#
+#   header   magic 'JBDL', version u8, cell count u8, NTC count u8,
+#            reserved u8, records per block u16, record size u16
+#   blocks   sync marker (b'\xffSYN' + block number u32), then up to
+#            'records per block' fixed width records
+#
+# A record is the sample time (epoch, f8) and the monotonic clock reading
+# it was taken from (f8, NaN if unknown), followed by the integers
+# BasicInfoReg and CellInfoReg deliver; see _recordFields.  mono keeps
+# gaps and ordering meaningful across wall clock steps.  NTCs are
+# stored raw (Kelvin * 10, 0 if absent).  All integers are little endian.
+#
+# Records are fixed width, so the reader can map the file and view each
+# column as an array.  The sync markers let it skip a torn block after a
+# crash.
+
+import os
+import mmap
+import array
+import struct
+
+from .parsers import DateParser, TempParser
+from .registers import BasicInfoReg
+from .optional import numpy as _numpy
+
+__all__ = ['BinLogWriter', 'BinLogReader']
+
+MAGIC = b'JBDL'
+VERSION = 2
+SYNC = b'\xffSYN'
+BLOCK_RECORDS = 256
+
+_header = struct.Struct('<4sBBBBHH')
+_sync = struct.Struct('<4sI')
+
+# name, struct code, array typecode
+_recordFields = (
+    ('t',         'd', 'd'),
+    ('mono',      'd', 'd'),
+    ('pack_mv',   'I', 'L'),
+    ('pack_ma',   'i', 'l'),
+    ('cur_cap',   'I', 'L'),
+    ('full_cap',  'I', 'L'),
+    ('cycle_cnt', 'H', 'H'),
+    ('cap_pct',   'B', 'B'),
+    ('fet_raw',   'B', 'B'),
+    ('fault_raw', 'H', 'H'),
+    ('bal_raw',   'I', 'L'),
+    ('date_raw',  'H', 'H'),
+    ('version',   'B', 'B'),
+)
+
+def _fields(cellCnt, ntcCnt):
+    return (*_recordFields,
+            *((f'ntc{i}_raw', 'H', 'H') for i in range(ntcCnt)),
+            *((f'cell{i}_mv', 'H', 'H') for i in range(cellCnt)))
+
+def _ntcRaw(v):
+    # TempParser.encode truncates to whole degrees; keep the tenths
+    return 0 if v is None else round(v * 10) + 2731
+
+class BinLogWriter:
+    '''writes .jbl files.  Cell and NTC counts are fixed per file; they are
+    taken from the first sample unless given.  File-like: write() /
+    flush() / close().'''
+    def __init__(self, fn, cellCnt = None, ntcCnt = None, blockRecords = BLOCK_RECORDS):
+        self.fn = fn
+        self.f = open(fn, 'wb')
+        self.blockRecords = blockRecords
+        self.cellCnt = cellCnt
+        self.ntcCnt = ntcCnt
+        self.records = 0
+        self._struct = None
+        if cellCnt is not None and ntcCnt is not None:
+            self._writeHeader()
+
+    def _writeHeader(self):
+        fmt = '<' + ''.join(code for _, code, _ in _fields(self.cellCnt, self.ntcCnt))
+        self._struct = struct.Struct(fmt)
+        self.f.write(_header.pack(MAGIC, VERSION, self.cellCnt, self.ntcCnt, 0,
+                                  self.blockRecords, self._struct.size))
+
+    def write(self, t, basicInfo, cellInfo, mono = None):
+        '''append one sample; basicInfo and cellInfo as returned by
+        JBD.readBasicInfo / readCellInfo, mono the monotonic time t came from'''
+        if self._struct is None:
+            self.cellCnt = len(cellInfo) if self.cellCnt is None else self.cellCnt
+            self.ntcCnt = basicInfo['ntc_cnt'] if self.ntcCnt is None else self.ntcCnt
+            self._writeHeader()
+        if not self.records % self.blockRecords:
+            self.f.write(_sync.pack(SYNC, self.records // self.blockRecords))
+
+        b = basicInfo
+        cells = list(cellInfo.values())[:self.cellCnt]
+        cells += [0] * (self.cellCnt - len(cells))
+        self.f.write(self._struct.pack(
+            t, float('nan') if mono is None else mono, b['pack_mv'], b['pack_ma'], b['cur_cap'], b['full_cap'],
+            b['cycle_cnt'], b['cap_pct'],
+            bool(b['chg_fet_en']) | (bool(b['dsg_fet_en']) << 1),
+            b['fault_raw'], b['bal_raw'],
+            DateParser.encode((b['year'], b['month'], b['day'])), b['version'],
+            *(_ntcRaw(b.get(f'ntc{i}')) for i in range(self.ntcCnt)),
+            *cells))
+        self.records += 1
+
+    def tell(self):
+        return self.f.tell()
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+class BinLogReader:
+    '''memory maps a .jbl file.  column(name) / columns(*names) return
+    arrays: NumPy arrays if NumPy is installed, else array.array.'''
+    def __init__(self, fn):
+        self.fn = fn
+        if fn.lower().endswith('.gz'): # rotated segment; read into memory
+            import gzip
+            with gzip.open(fn, 'rb') as f:
+                self._mm = f.read()
+        else:
+            with open(fn, 'rb') as f:
+                # mmap can't map an empty file
+                empty = os.fstat(f.fileno()).st_size < _header.size
+                self._mm = b'' if empty else mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        self.empty = len(self._mm) < _header.size
+        if self.empty:
+            # just opened by a writer that has no sample yet (or the header is
+            # still being written): an empty log, with no columns known yet
+            self.cellCnt = self.ntcCnt = 0
+            self.blockRecords = BLOCK_RECORDS
+            self.fields = _fields(0, 0)
+            self._struct = struct.Struct('<' + ''.join(code for _, code, _ in self.fields))
+            self.names = [name for name, _, _ in self.fields]
+            self.segments = []
+            return
+        try:
+            magic, version, self.cellCnt, self.ntcCnt, _, self.blockRecords, recordSize = \
+                _header.unpack_from(self._mm, 0)
+        except struct.error:
+            self.close()
+            raise ValueError(f'{fn}: not a binary log') from None
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f'{fn}: not a version {VERSION} binary log')
+        self.fields = _fields(self.cellCnt, self.ntcCnt)
+        self._struct = struct.Struct('<' + ''.join(code for _, code, _ in self.fields))
+        assert self._struct.size == recordSize
+        self.names = [name for name, _, _ in self.fields]
+        self.segments = self._scan()
+
+    def _scan(self):
+        'return [(offset, record count), ...] of the intact parts of the file'
+        segments = []
+        mm = self._mm
+        size = len(mm)
+        recordSize = self._struct.size
+        blockSize = _sync.size + self.blockRecords * recordSize
+        off = _header.size
+        while off + _sync.size <= size:
+            if mm[off:off + 4] != SYNC:
+                # torn block; resync on the next marker
+                off = mm.find(SYNC, off + 1)
+                if off < 0: break
+                continue
+            n = min(self.blockRecords, (size - off - _sync.size) // recordSize)
+            if n:
+                segments.append((off + _sync.size, n))
+            off += blockSize
+        return segments
+
+    def __len__(self):
+        return sum(n for _, n in self.segments)
+
+    def _blockTime(self, segment):
+        return struct.unpack_from('<d', self._mm, segment[0])[0]
+
+    def _segmentsBetween(self, start, end):
+        'the segments that may hold records with start <= t < end, found by bisecting block start times'
+        segments = self.segments
+        lo, hi = 0, len(segments)
+        if start is not None:
+            # last block starting at or before start
+            a, b = 0, len(segments)
+            while a < b:
+                m = (a + b) // 2
+                if self._blockTime(segments[m]) <= start: a = m + 1
+                else: b = m
+            lo = max(0, a - 1)
+        if end is not None:
+            a, b = lo, len(segments)
+            while a < b:
+                m = (a + b) // 2
+                if self._blockTime(segments[m]) < end: a = m + 1
+                else: b = m
+            hi = a
+        return segments[lo:hi]
+
+    def columns(self, *names, start = None, end = None):
+        '''return {name: array} for records with start <= t < end; ntcN gives
+        NTC temperatures in Celsius (NaN if absent).  An empty log gives
+        empty arrays for any name.'''
+        np = _numpy()
+        if self.empty:
+            return {name: np.zeros(0) if np is not None else array.array('d') for name in names}
+        want = {}
+        for name in names:
+            want[name] = name + '_raw' if name.startswith('ntc') and not name.endswith('_raw') else name
+            if want[name] not in self.names:
+                raise KeyError(name)
+        segments = self._segmentsBetween(start, end)
+        if np is not None:
+            dtype = np.dtype([(n, '<' + code) for n, code, _ in self.fields])
+            parts = [np.frombuffer(self._mm, dtype = dtype, count = n, offset = off)
+                     for off, n in segments]
+            recs = np.concatenate(parts) if parts else np.zeros(0, dtype = dtype)
+            del parts
+            if start is not None or end is not None:
+                t = recs['t']
+                mask = np.ones(len(recs), dtype = bool)
+                if start is not None: mask &= t >= start
+                if end is not None: mask &= t < end
+                recs = recs[mask]
+            ret = {}
+            for name, raw in want.items():
+                col = recs[raw].copy()
+                if raw != name:
+                    col = np.where(col == 0, np.nan, (col.astype(np.float64) - 2731) / 10)
+                ret[name] = col
+            del recs
+            return ret
+
+        idx = {n: i for i, n in enumerate(self.names)}
+        typecodes = {n: tc for n, _, tc in self.fields}
+        ret = {name: array.array('d' if raw != name else typecodes[raw]) for name, raw in want.items()}
+        for off, n in segments:
+            for rec in self._struct.iter_unpack(self._mm[off:off + n * self._struct.size]):
+                if start is not None and rec[0] < start: continue
+                if end is not None and rec[0] >= end: continue
+                for name, raw in want.items():
+                    v = rec[idx[raw]]
+                    if raw != name:
+                        v = float('nan') if v == 0 else TempParser.decode(v)[0]
+                    ret[name].append(v)
+        return ret
+
+    def column(self, name):
+        return self.columns(name)[name]
+
+    def samples(self, start = None, end = None):
+        '''yield (t, basicInfo, cellInfo) per record with start <= t < end,
+        with dicts shaped like JBD.readBasicInfo() / readCellInfo()'''
+        idx = {n: i for i, n in enumerate(self.names)}
+        ntcIdx = [idx[f'ntc{i}_raw'] for i in range(self.ntcCnt)]
+        cellIdx = [idx[f'cell{i}_mv'] for i in range(self.cellCnt)]
+        for off, n in self._segmentsBetween(start, end):
+            for rec in self._struct.iter_unpack(self._mm[off:off + n * self._struct.size]):
+                if start is not None and rec[0] < start: continue
+                if end is not None and rec[0] >= end: return
+                b = {n: rec[idx[n]] for n in ('pack_mv', 'pack_ma', 'cur_cap', 'full_cap',
+                                              'cycle_cnt', 'cap_pct', 'fault_raw', 'bal_raw', 'version')}
+                b['year'], b['month'], b['day'] = DateParser.decode(rec[idx['date_raw']])
+                for bit, name in enumerate(BasicInfoReg._fetBits):
+                    b[name] = bool(rec[idx['fet_raw']] & (1 << bit))
+                b['ntc_cnt'] = self.ntcCnt
+                b['cell_cnt'] = self.cellCnt
+                for i, j in enumerate(ntcIdx):
+                    b[f'ntc{i}'] = TempParser.decode(rec[j])[0] if rec[j] else None
+                b = BasicInfoReg.expand(b)
+                cells = {f'cell{i}_mv': rec[j] for i, j in enumerate(cellIdx)}
+                yield rec[0], b, cells
+
+    def close(self):
+        if isinstance(getattr(self, '_mm', None), mmap.mmap):
+            self._mm.close()
+        self._mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+
+# BMS Tools
+# Copyright (C) 2020 Eric Poulsen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Raw frame capture (.jbc).
+#
+# Every response frame JBD._readPacket receives is appended byte for byte,
+# with a time.monotonic() timestamp and a port id; nothing is decoded on
+# the poll path.  Decoding happens when the capture is read, through the
+# same register classes JBD uses.
+#
+#   header   magic 'JBDC', version u8, epoch f8, monotonic f8 at open
+#   records  kind u8, port u8, monotonic time f8, length u16, data
+#
+# kind 0 declares a port (data is its utf-8 name), kind 1 is a frame and
+# kind 2 the bytes of a frame that never completed (the read timed out),
+# kept for firmware debugging.  Frames with a bad checksum are complete
+# frames; they are captured as kind 1 and decode() rejects them.
+#
+#   python -m bmstools.jbd.capture dump.jbc
+
+import mmap
+import bisect
+import struct
+import itertools
+import threading
+import time
+
+from .registers import BasicInfoReg, CellInfoReg, DeviceInfoReg
+from .regmap import makeEepromRegs
+
+__all__ = ['FrameCapture', 'CaptureReader', 'Frame']
+
+MAGIC = b'JBDC'
+VERSION = 1
+
+_header = struct.Struct('<4sBdd')
+_record = struct.Struct('<BBdH')
+
+KIND_PORT = 0
+KIND_FRAME = 1
+KIND_PARTIAL = 2
+
+class FrameCapture:
+    '''appends raw frames to a .jbc file.  attach() it to one or more JBD
+    instances; each gets its own port id.'''
+    def __init__(self, fn):
+        self.fn = fn
+        self.f = open(fn, 'wb')
+        self.f.write(_header.pack(MAGIC, VERSION, time.time(), time.monotonic()))
+        self.lock = threading.Lock()
+        self.ports = []
+        self.jbds = []
+
+    def addPort(self, name):
+        'declare a port; returns its id'
+        with self.lock:
+            portId = len(self.ports)
+            if portId > 0xff:
+                raise ValueError('too many ports')
+            name = str(name).encode('utf-8')
+            self.ports.append(name)
+            self.f.write(_record.pack(KIND_PORT, portId, time.monotonic(), len(name)) + name)
+            return portId
+
+    def attach(self, jbd, name = None):
+        '''capture everything jbd reads; name defaults to its serial port.
+        Returns self.'''
+        if name is None:
+            name = getattr(jbd.serial, 'port', None) or f'port{len(self.ports)}'
+        jbd.capturePort = self.addPort(name)
+        jbd.capture = self
+        self.jbds.append(jbd)
+        return self
+
+    def frame(self, data, portId = 0, t = None, complete = True):
+        '''append one raw frame, or with complete False the bytes of an
+        incomplete one; called from JBD._readPacket'''
+        t = time.monotonic() if t is None else t
+        kind = KIND_FRAME if complete else KIND_PARTIAL
+        with self.lock:
+            if self.f:
+                self.f.write(_record.pack(kind, portId, t, len(data)) + data)
+
+    def flush(self):
+        with self.lock:
+            if self.f: self.f.flush()
+
+    def close(self):
+        for jbd in self.jbds:
+            if jbd.capture is self:
+                jbd.capture = None
+        self.jbds = []
+        with self.lock:
+            if self.f:
+                self.f.close()
+                self.f = None
+
+class Frame:
+    '''one captured frame; decode() runs the register class on first use.
+    complete is False for the bytes of a frame whose read timed out.'''
+    __slots__ = ('reader', 't', 'time', 'port', 'raw', 'complete', '_decoded')
+
+    def __init__(self, reader, t, port, raw, complete = True):
+        self.reader = reader
+        self.t = t                # monotonic
+        self.time = reader.epoch + (t - reader.monotonic)
+        self.port = port
+        self.raw = raw
+        self.complete = complete
+        self._decoded = False
+
+    @property
+    def reg(self):
+        return self.raw[1] if len(self.raw) > 1 else None
+
+    @property
+    def ok(self):
+        return self.complete and not self.raw[2]
+
+    @property
+    def payload(self):
+        return self.raw[4:4 + self.raw[3]] if len(self.raw) > 3 else b''
+
+    @property
+    def checksumOk(self):
+        'True if the checksum matches: 0x10000 - sum of status, length and payload'
+        raw = self.raw
+        if not self.complete or len(raw) < 7: return False
+        end = 4 + raw[3]
+        return (0x10000 - sum(raw[2:end])) & 0xffff == int.from_bytes(raw[end:end + 2], 'big')
+
+    def decode(self):
+        '''return the frame's values as a dict, as JBD.readBasicInfo() etc.
+        would; None for NAKs, incomplete frames, bad checksums, empty
+        payloads and registers without a class'''
+        if self._decoded is False:
+            self._decoded = self.reader._decode(self)
+        return self._decoded
+
+    def __repr__(self):
+        if not self.complete:
+            return f'<{self.__class__.__name__}: port {self.port} incomplete, {len(self.raw)} bytes>'
+        return f'<{self.__class__.__name__}: port {self.port} reg 0x{self.reg:02X} {len(self.payload)} bytes>'
+
+class CaptureReader:
+    def __init__(self, fn):
+        self.fn = fn
+        with open(fn, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        try:
+            magic, version, self.epoch, self.monotonic = _header.unpack_from(self._mm, 0)
+        except struct.error:
+            self.close()
+            raise ValueError(f'{fn}: not a frame capture') from None
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f'{fn}: not a version {VERSION} frame capture')
+        self.ports = {}
+        self._index = self._scan()
+        self._regs = None
+
+    def _scan(self):
+        '''index frames as [(t, port id, offset, length, complete), ...]; a
+        torn last record is ignored'''
+        index = []
+        mm = self._mm
+        off = _header.size
+        size = len(mm)
+        while off + _record.size <= size:
+            kind, port, t, n = _record.unpack_from(mm, off)
+            off += _record.size
+            if off + n > size: break
+            if kind == KIND_PORT:
+                self.ports[port] = str(mm[off:off + n], 'utf-8', 'replace')
+            elif kind in (KIND_FRAME, KIND_PARTIAL):
+                index.append((t, port, off, n, kind == KIND_FRAME))
+            off += n
+        return index
+
+    def __len__(self):
+        return len(self._index)
+
+    def frames(self, reg = None, port = None, start = None, end = None, incomplete = False):
+        '''yield Frames, optionally only those for register reg, port (id or
+        name), and monotonic time start <= t < end.  Incomplete frames are
+        skipped unless incomplete is True (and reg is None).'''
+        if isinstance(port, str):
+            port = {v: k for k, v in self.ports.items()}.get(port, -1)
+        mm = self._mm
+        first = 0 if start is None else bisect.bisect_left(self._index, (start,))
+        for t, p, off, n, complete in itertools.islice(self._index, first, None):
+            if end is not None and t >= end: break
+            if port is not None and p != port: continue
+            if not complete and (not incomplete or reg is not None): continue
+            if reg is not None and (n < 2 or mm[off + 1] != reg): continue
+            yield Frame(self, t, self.ports.get(p, p), mm[off:off + n], complete)
+
+    def __iter__(self):
+        return self.frames()
+
+    def toMonotonic(self, t):
+        'capture monotonic time for epoch time t'
+        return None if t is None else t - self.epoch + self.monotonic
+
+    def samples(self, port = None, start = None, end = None):
+        '''yield (epoch time, basicInfo, cellInfo) for each basic info frame
+        followed by a cell info frame on the same port, with epoch times
+        start <= t < end'''
+        basic = {}
+        for frame in self.frames(port = port, start = self.toMonotonic(start), end = self.toMonotonic(end)):
+            if frame.reg == 0x03:
+                basic[frame.port] = frame
+            elif frame.reg == 0x04 and basic.get(frame.port):
+                b, c = basic.pop(frame.port).decode(), frame.decode()
+                if b is not None and c is not None:
+                    yield frame.time, b, c
+
+    def _decode(self, frame):
+        if self._regs is None:
+            self._regs = {reg.adx: reg for reg in makeEepromRegs()}
+            for reg in (BasicInfoReg('basic_info', 0x03),
+                        CellInfoReg('cell_info', 0x04),
+                        DeviceInfoReg('device_info', 0x05)):
+                self._regs[reg.adx] = reg
+        reg = self._regs.get(frame.reg)
+        payload = frame.payload
+        if reg is None or not frame.ok or not frame.checksumOk or not payload:
+            return None
+        try:
+            reg.unpack(payload)
+        except (ValueError, struct.error):
+            return None
+        return dict(reg)
+
+    def close(self):
+        if getattr(self, '_mm', None) is not None:
+            self._mm.close()
+            self._mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+def main():
+    import argparse
+    p = argparse.ArgumentParser(description = 'dump a raw frame capture')
+    p.add_argument('capture', help = '.jbc file')
+    p.add_argument('-r', '--reg', type = lambda x: int(x, 0), help = 'only this register, e.g. 0x03')
+    p.add_argument('-d', '--decode', action = 'store_true', help = 'decode frames')
+    p.add_argument('-i', '--incomplete', action = 'store_true', help = 'include incomplete frames')
+    args = p.parse_args()
+
+    with CaptureReader(args.capture) as r:
+        for frame in r.frames(args.reg, incomplete = args.incomplete):
+            ts = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(frame.time))
+            flag = '' if frame.complete else ' (incomplete)'
+            print(f'{ts}.{int(frame.time % 1 * 1000):03d} {frame.port} {frame.raw.hex(" ").upper()}{flag}')
+            if args.decode and frame.complete:
+                print(f'    {frame.decode()}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+# BMS Tools
+# Copyright (C) 2020 Eric Poulsen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Fleet configuration drift against a golden EEPROM config.
+#
+# Every snapshot (a .fig file, a readEeprom() dict or an {adx: bytes}
+# image) is canonicalised to packed register bytes via BaseReg.pack, and
+# hashed.  Packs whose hash matches the golden image are done; the rest
+# are grouped by diff signature (the set of differing registers and their
+# bytes), so the per-field report is decoded once per cluster, not once
+# per pack.
+#
+#   python -m bmstools.jbd.drift golden.fig <.fig files or directories>
+
+import os
+import sys
+import hashlib
+
+from .regmap import makeEepromRegs, regDefByRegName, regDefByValueName
+from .image import dataToImage, EepromImage, ImageError, MAGIC as IMAGE_MAGIC
+from .persist import JBDPersist
+from .registers import ReadOnlyMixin
+
+__all__ = ['canonicalImage', 'imageHash', 'DriftCluster', 'driftReport', 'loadSnapshot']
+
+# registers that are unique per pack, and would otherwise put every pack in its own cluster
+defaultIgnore = ('serial_num', 'barcode', 'mfg_date', 'cycle_cnt')
+
+_configAdxSet = None
+
+def _configAdxs():
+    '''addresses of the writable config registers; read-only ones (error
+    counts) are never part of a config.  Built on first use, not import.'''
+    global _configAdxSet
+    if _configAdxSet is None:
+        _configAdxSet = frozenset(reg.adx for reg in makeEepromRegs() if not isinstance(reg, ReadOnlyMixin))
+    return _configAdxSet
+
+def _ignoredAdxs(ignore):
+    adxs = set()
+    for name in ignore:
+        regDef = regDefByRegName.get(name) or regDefByValueName.get(name)
+        if regDef is None:
+            raise KeyError(f'unknown register or value name {name}')
+        adxs.add(regDef.adx)
+    return adxs
+
+def canonicalImage(snapshot, ignore = ()):
+    '''return the packed {adx: bytes} image of the config registers in a
+    value dict or an image, without the ignored registers; ignore holds
+    register addresses'''
+    items = snapshot.items()
+    if not all(isinstance(k, int) for k in snapshot.keys()):
+        items = dataToImage(snapshot).items()
+    configAdxs = _configAdxs()
+    return {adx: bytes(payload) for adx, payload in items
+            if adx in configAdxs and adx not in ignore}
+
+def imageHash(image):
+    h = hashlib.sha1()
+    for adx, payload in sorted(image.items()):
+        h.update(bytes((adx, len(payload))))
+        h.update(payload)
+    return h.digest()
+
+class DriftCluster:
+    'a group of packs that differ from the golden config in exactly the same way'
+    def __init__(self, signature):
+        self.signature = signature # ((adx, payload or None), ...)
+        self.packs = []
+        self.diffs = [] # [(valueName, golden value, pack value), ...]
+
+    def __len__(self):
+        return len(self.packs)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}: {len(self.packs)} packs, {len(self.diffs)} diffs>'
+
+def _decode(regs, adx, payload):
+    if payload is None:
+        return {}
+    reg = regs[adx]
+    reg.unpack(payload)
+    return dict(reg)
+
+def _fieldDiffs(regs, golden, signature):
+    diffs = []
+    for adx, payload in signature:
+        old = _decode(regs, adx, golden.get(adx))
+        new = _decode(regs, adx, payload)
+        for n in old.keys() | new.keys():
+            if old.get(n) != new.get(n):
+                diffs.append((n, old.get(n), new.get(n)))
+    return sorted(diffs, key = lambda d: str(d[0]))
+
+def driftReport(golden, snapshots, ignore = defaultIgnore):
+    '''compare snapshots, a {pack id: snapshot} dict, against golden.
+    Returns (ids matching golden, [DriftCluster, ...] largest first).'''
+    ignore = _ignoredAdxs(ignore)
+    golden = canonicalImage(golden, ignore)
+    goldenHash = imageHash(golden)
+    regs = {reg.adx: reg for reg in makeEepromRegs()}
+
+    matching = []
+    clusters = {}
+    for packId, snapshot in snapshots.items():
+        image = canonicalImage(snapshot, ignore)
+        if imageHash(image) == goldenHash:
+            matching.append(packId)
+            continue
+        signature = tuple(sorted(
+            (adx, image.get(adx)) for adx in golden.keys() | image.keys()
+            if image.get(adx) != golden.get(adx)))
+        cluster = clusters.get(signature)
+        if cluster is None:
+            cluster = clusters[signature] = DriftCluster(signature)
+        cluster.packs.append(packId)
+
+    for cluster in clusters.values():
+        cluster.diffs = _fieldDiffs(regs, golden, cluster.signature)
+    return matching, sorted(clusters.values(), key = len, reverse = True)
+
+def loadSnapshot(fn):
+    'load a .fig file as a value dict, or a binary image file as an image'
+    if fn.lower().endswith('.fig'):
+        with open(fn, encoding = 'utf-8', errors = 'replace') as f:
+            return JBDPersist().deserialize(f.read(), [])
+    with EepromImage(fn) as img:
+        return dict(img.items())
+
+def isSnapshotFile(fn):
+    'True for .fig files and binary image files (by magic); used to filter directory walks'
+    if fn.lower().endswith('.fig'):
+        return True
+    try:
+        with open(fn, 'rb') as f:
+            return f.read(len(IMAGE_MAGIC)) == IMAGE_MAGIC
+    except OSError:
+        return False
+
+def main():
+    import argparse
+    p = argparse.ArgumentParser(description = 'report EEPROM config drift against a golden config')
+    p.add_argument('golden', help = 'golden .fig or image file')
+    p.add_argument('snapshots', nargs = '+', help = '.fig / image files, or directories of them')
+    p.add_argument('-i', '--ignore', action = 'append', default = [],
+                   help = f'register or value name to ignore, in addition to {", ".join(defaultIgnore)} (repeatable)')
+    args = p.parse_args()
+
+    snapshots = {}
+    for path in args.snapshots:
+        if os.path.isdir(path):
+            for dirpath, _, filenames in os.walk(path):
+                for fn in filenames:
+                    fn = os.path.join(dirpath, fn)
+                    if isSnapshotFile(fn):
+                        snapshots[fn] = None
+        else:
+            snapshots[path] = None
+    errors = []
+    for fn in sorted(snapshots):
+        try:
+            snapshots[fn] = loadSnapshot(fn)
+        except (ImageError, ValueError, OSError) as e:
+            errors.append(str(e) if fn in str(e) else f'{fn}: {e}')
+            del snapshots[fn]
+
+    ignore = (*defaultIgnore, *args.ignore)
+    matching, clusters = driftReport(loadSnapshot(args.golden), snapshots, ignore)
+    print(f'{len(matching)} of {len(snapshots)} packs match {args.golden}')
+    for i, cluster in enumerate(clusters):
+        print(f'\ncluster {i+1}: {len(cluster)} packs')
+        for n, old, new in cluster.diffs:
+            print(f'    {n}: {old} -> {new}')
+        for packId in cluster.packs:
+            print(f'    {packId}')
+    if errors:
+        print(f'\n{len(errors)} files could not be read:', file = sys.stderr)
+        for error in errors:
+            print(f'    {error}', file = sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+# BMS Tools
+# Copyright (C) 2020 Eric Poulsen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Coulomb and energy counting from pack_mv / pack_ma samples.
+#
+#   c = EnergyCounter()
+#   c.update(basicInfo)            # per sample, O(1)
+#   c.whIn, c.whOut, c.efficiency, c.cycles, c.soc
+#
+# Charge and energy are integrated with the trapezoidal rule over the
+# actual sample interval; an interval that crosses zero current is split
+# at the crossing, so charge and discharge are counted separately.
+# Positive pack_ma is charging, as the BMS reports it.  Intervals longer
+# than maxGap (e.g. the poller was stopped) are not integrated.
+#
+# The state of charge is seeded from the BMS's cur_cap / full_cap on the
+# first sample and then carried by the counter alone.
+#
+# EnergyCounters keeps one counter per pack and checkpoints them all to a
+# JSON file, so totals survive restarts.  Only the totals, capacity and
+# remaining charge are checkpointed: the last sample's time is on the
+# monotonic clock, which means nothing in another process, so a restored
+# counter starts integrating from its next sample.
+
+import os
+import json
+import time
+
+__all__ = ['EnergyCounter', 'EnergyCounters']
+
+def _split(a, b, dt):
+    '''trapezoid area of a straight line from a to b over dt, as (positive
+    part, negative part)'''
+    if a * b >= 0: # no sign change; an idle end takes the sign of the other
+        area = (a + b) * dt / 2
+        return (area, 0.0) if area >= 0 else (0.0, area)
+    f = a / (a - b) # fraction of dt before the zero crossing
+    first, second = a * f * dt / 2, b * (1 - f) * dt / 2
+    return (first, second) if a > 0 else (second, first)
+
+class EnergyCounter:
+    'charge (mAh) and energy (Wh) in and out of one pack; see the module comment'
+    state = ('mahIn', 'mahOut', 'whIn', 'whOut', 'capacity', 'remaining', 'samples', 'gaps')
+
+    def __init__(self, capacity = None, maxGap = 60):
+        self.maxGap = maxGap
+        self.capacity = capacity # mAh; from full_cap if None
+        self.remaining = None    # mAh
+        self.t = self.mv = self.ma = None
+        self.mahIn = self.mahOut = 0.0
+        self.whIn = self.whOut = 0.0
+        self.samples = 0
+        self.gaps = 0
+
+    def add(self, t, mv, ma):
+        'add one sample: t in seconds, pack mV and mA'
+        lastT, lastMv, lastMa = self.t, self.mv, self.ma
+        self.t, self.mv, self.ma = t, mv, ma
+        self.samples += 1
+        if lastT is None: return
+        dt = t - lastT
+        if dt <= 0: return
+        if self.maxGap is not None and dt > self.maxGap:
+            self.gaps += 1
+            return
+        qIn, qOut = _split(lastMa, ma, dt / 3600)                        # mAh
+        eIn, eOut = _split(lastMv * lastMa, mv * ma, dt / 3600 / 1e6)    # Wh
+        self.mahIn += qIn
+        self.mahOut -= qOut
+        self.whIn += eIn
+        self.whOut -= eOut
+        if self.remaining is not None:
+            self.remaining = max(0.0, self.remaining + qIn + qOut)
+            if self.capacity:
+                self.remaining = min(self.remaining, float(self.capacity))
+
+    def update(self, basicInfo, cellInfo = None, t = None):
+        'add a readBasicInfo() sample taken at time t; cellInfo is not used'
+        t = time.monotonic() if t is None else t
+        if self.capacity is None and basicInfo.get('full_cap'):
+            self.capacity = basicInfo['full_cap']
+        if self.remaining is None and basicInfo.get('cur_cap') is not None:
+            self.remaining = float(basicInfo['cur_cap'])
+        self.add(t, basicInfo['pack_mv'], basicInfo['pack_ma'])
+        return self
+
+    @property
+    def mah(self):
+        'net charge in mAh'
+        return self.mahIn - self.mahOut
+
+    @property
+    def wh(self):
+        'net energy in Wh'
+        return self.whIn - self.whOut
+
+    @property
+    def efficiency(self):
+        'round trip energy efficiency, Wh out / Wh in; None before any charge'
+        return self.whOut / self.whIn if self.whIn else None
+
+    @property
+    def coulombic(self):
+        'mAh out / mAh in; None before any charge'
+        return self.mahOut / self.mahIn if self.mahIn else None
+
+    @property
+    def cycles(self):
+        'equivalent full cycles: discharged mAh / capacity'
+        return self.mahOut / self.capacity if self.capacity else None
+
+    @property
+    def soc(self):
+        'state of charge in percent, or None if unknown'
+        if self.remaining is None or not self.capacity: return None
+        return 100 * self.remaining / self.capacity
+
+    def checkpoint(self):
+        'return the counter state as a JSON serialisable dict'
+        return {n: getattr(self, n) for n in self.state}
+
+    def restore(self, state):
+        'restore a checkpoint(); the next sample starts a new interval'
+        self.t = self.mv = self.ma = None
+        for n in self.state:
+            if n in state: setattr(self, n, state[n])
+        return self
+
+    def summary(self):
+        return {
+            'mah_in': self.mahIn, 'mah_out': self.mahOut,
+            'wh_in': self.whIn, 'wh_out': self.whOut,
+            'efficiency': self.efficiency, 'coulombic': self.coulombic,
+            'cycles': self.cycles, 'soc': self.soc,
+        }
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}: in {self.whIn:.3f} Wh, out {self.whOut:.3f} Wh, {self.samples} samples>'
+
+class EnergyCounters:
+    '''EnergyCounter per pack, checkpointed to a JSON file.  Counters are
+    restored from fn if it exists; save() writes it (atomically) and is
+    called every checkpointSeconds of sample time by update().'''
+    def __init__(self, fn = None, checkpointSeconds = 300, **kwargs):
+        self.fn = fn
+        self.checkpointSeconds = checkpointSeconds
+        self.kwargs = kwargs
+        self.counters = {}
+        self.lastCheckpoint = None
+        if fn and os.path.exists(fn):
+            with open(fn) as f:
+                for pack, state in json.load(f).items():
+                    self[pack].restore(state)
+
+    def __getitem__(self, pack):
+        pack = str(pack)
+        c = self.counters.get(pack)
+        if c is None:
+            c = self.counters[pack] = EnergyCounter(**self.kwargs)
+        return c
+
+    def __iter__(self):
+        return iter(self.counters)
+
+    def __len__(self):
+        return len(self.counters)
+
+    def update(self, pack, basicInfo, cellInfo = None, t = None):
+        t = time.monotonic() if t is None else t
+        c = self[pack].update(basicInfo, cellInfo, t)
+        if self.fn and self.checkpointSeconds is not None:
+            if self.lastCheckpoint is None:
+                self.lastCheckpoint = t
+            elif t - self.lastCheckpoint >= self.checkpointSeconds:
+                self.save()
+                self.lastCheckpoint = t
+        return c
+
+    def save(self, fn = None):
+        fn = fn or self.fn
+        with open(fn + '.tmp', 'w') as f:
+            json.dump({pack: c.checkpoint() for pack, c in self.counters.items()}, f, indent = 1)
+        os.replace(fn + '.tmp', fn)
+
+    def summary(self):
+        return {pack: c.summary() for pack, c in self.counters.items()}
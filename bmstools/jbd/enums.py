@@ -16,7 +16,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from enum import Enum
+from enum import Enum, EnumMeta
 class Unit(Enum):
     MV   = ('millivolt', 'mV')
     V    = ('volt', 'V')
@@ -35,7 +35,16 @@ class Unit(Enum):
         self.long_name = long_name
         self.symbol = symbol
 
-class LabelEnum(Enum):
+class LabelEnumMeta(EnumMeta):
+    'builds the byValue / byDisplay lookup tables once, when the class is created'
+    def __new__(metacls, cls, bases, classdict, **kwargs):
+        enumClass = super().__new__(metacls, cls, bases, classdict, **kwargs)
+        members = list(enumClass)
+        enumClass._byValueMap = {m.val: m for m in members}
+        enumClass._byDisplayMap = {m.display: m for m in members}
+        return enumClass
+
+class LabelEnum(Enum, metaclass=LabelEnumMeta):
     def __new__(cls, display, value):
         obj = object.__new__(cls)
         obj.val = value
@@ -47,17 +56,16 @@ class LabelEnum(Enum):
 
     @classmethod
     def byDisplay(cls, value):
-        for v in cls:
-            if value == v.display:
-                return v
-        return None
+        return cls._byDisplayMap.get(value)
 
     @classmethod
     def byValue(cls, value):
-        for v in cls:
-            if value == v.val:
-                return v
-        return None
+        return cls._byValueMap.get(value)
+
+    @classmethod
+    def byValues(cls, values):
+        'bulk byValue; values is any iterable of ints, e.g. bytes'
+        return list(map(cls._byValueMap.get, values))
 
 class Dsgoc2Enum(LabelEnum):
     _8MV  = (8,   0x0)
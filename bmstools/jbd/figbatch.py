@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+# BMS Tools
+# Copyright (C) 2020 Eric Poulsen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Bulk .fig conversion and validation.
+#
+# Walks a directory tree for .fig files, parses and validates each one in
+# a process pool, and writes one summary row per file to a CSV file or
+# SQLite database.  Per-file problems are collected in the summary rather
+# than printed.
+#
+#   python -m bmstools.jbd.figbatch <dir> <summary.csv | summary.sqlite>
+
+import os
+import csv
+import multiprocessing
+
+from .persist import JBDPersist
+from .regmap import figFields, makeEepromRegs, validateData
+
+__all__ = ['findFigs', 'checkFig', 'scanFigs']
+
+# summary columns: file name, error count, errors, then every .fig value
+valueNames = [n for valueNames, _ in figFields.values() for n in valueNames]
+columns = ['file', 'error_cnt', 'errors', *valueNames]
+
+_regs = None # per-process register instances, reused across files
+
+def findFigs(root):
+    'yield .fig file names under root, in sorted order'
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for fn in sorted(filenames):
+            if fn.lower().endswith('.fig'):
+                yield os.path.join(dirpath, fn)
+
+def checkFig(fn):
+    'parse and validate one .fig file; returns (fn, data, errors)'
+    global _regs
+    if _regs is None:
+        _regs = makeEepromRegs()
+    errors = []
+    try:
+        with open(fn, encoding = 'utf-8', errors = 'replace') as f:
+            text = f.read()
+        data = JBDPersist().deserialize(text, errors)
+    except Exception as e:
+        return fn, {}, [f'unreadable: {e!r}']
+    missing = [n for n in valueNames if n not in data]
+    if missing:
+        errors.append('missing values: ' + ' '.join(missing))
+    errors += validateData(data, _regs)
+    return fn, data, errors
+
+def _cell(value):
+    'summary cell value; enums by display value, bools as ints'
+    if value is None or isinstance(value, (int, float, str)):
+        return int(value) if isinstance(value, bool) else value
+    return str(value)
+
+class _CsvSummary:
+    def __init__(self, fn):
+        self.f = open(fn, 'w', newline = '')
+        self.w = csv.writer(self.f)
+        self.w.writerow(columns)
+
+    def write(self, row):
+        self.w.writerow(row)
+
+    def close(self):
+        self.f.close()
+
+class _SqliteSummary:
+    def __init__(self, fn):
+        import sqlite3
+        if os.path.exists(fn):
+            os.remove(fn)
+        self.db = sqlite3.connect(fn)
+        cols = ', '.join(f'"{c}"' for c in columns)
+        self.db.execute(f'CREATE TABLE figs ({cols})')
+        self.insert = f'INSERT INTO figs VALUES ({", ".join("?" * len(columns))})'
+
+    def write(self, row):
+        self.db.execute(self.insert, row)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+def scanFigs(root, summaryFn, workers = None, progressFunc = None):
+    '''check every .fig file under root and write the summary to summaryFn
+    (.sqlite, .sqlite3 or .db for SQLite, otherwise CSV).  workers is the
+    process count; 1 runs in this process.  Returns (file count, files with errors).'''
+    if summaryFn.lower().endswith(('.sqlite', '.sqlite3', '.db')):
+        summary = _SqliteSummary(summaryFn)
+    else:
+        summary = _CsvSummary(summaryFn)
+
+    files = findFigs(root)
+    pool = None
+    if workers == 1:
+        results = map(checkFig, files)
+    else:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap(checkFig, files, chunksize = 32)
+
+    cnt = errCnt = 0
+    try:
+        for fn, data, errors in results:
+            cnt += 1
+            errCnt += bool(errors)
+            row = [os.path.relpath(fn, root), len(errors), '; '.join(errors)]
+            row += [_cell(data.get(n)) for n in valueNames]
+            summary.write(row)
+            if progressFunc: progressFunc(cnt)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        summary.close()
+    return cnt, errCnt
+
+def main():
+    import argparse
+    p = argparse.ArgumentParser(description = 'validate a directory tree of .fig files')
+    p.add_argument('root', help = 'directory to search for .fig files')
+    p.add_argument('summary', help = 'summary output, .csv or .sqlite')
+    p.add_argument('-j', '--jobs', type = int, default = None, help = 'worker processes (default: CPU count)')
+    args = p.parse_args()
+
+    cnt, errCnt = scanFigs(args.root, args.summary, args.jobs)
+    print(f'{cnt} files, {errCnt} with errors')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+# BMS Tools
+# Copyright (C) 2020 Eric Poulsen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Binary EEPROM image files.
+#
+# An image is the raw register payloads exactly as read from the device,
+# i.e. the {adx: bytes} dict returned by JBD.readRange().  On disk:
+#
+#   header   magic 'JBDE', version u8, reserved u8, slot size u16, slot count u16
+#   index    256 x u16; slot number + 1 for each address, 0 if absent
+#   slots    slot count x (adx u8, payload length u8, payload, zero padded)
+#
+# All integers are little endian.  The index makes register access O(1),
+# and EepromImage reads it through mmap, so opening an image is cheap.
+
+import mmap
+import struct
+
+from .regmap import makeEepromRegs
+from .registers import ReadOnlyException
+from .persist import JBDPersist
+
+__all__ = ['EepromImage', 'packImage', 'saveImage', 'loadImage',
+           'imageToData', 'dataToImage', 'figToImage', 'imageToFig']
+
+MAGIC = b'JBDE'
+VERSION = 1
+MAX_PAYLOAD = 32 # StringReg payloads are 1 + 31 bytes
+
+_header = struct.Struct('<4sBBHH')
+_index = struct.Struct('<256H')
+_slotHeader = struct.Struct('<BB')
+SLOT_SIZE = _slotHeader.size + MAX_PAYLOAD
+DATA_OFFSET = _header.size + _index.size
+
+class ImageError(ValueError): pass
+
+def packImage(image):
+    'return the binary file contents for an {adx: bytes} image'
+    index = [0] * 256
+    slots = []
+    for adx, payload in sorted(image.items()):
+        if not 0 <= adx <= 0xFF:
+            raise ImageError(f'address {adx!r} out of range')
+        payload = bytes(payload)
+        if len(payload) > MAX_PAYLOAD:
+            raise ImageError(f'payload for 0x{adx:02X} is longer than {MAX_PAYLOAD} bytes')
+        slots.append(_slotHeader.pack(adx, len(payload)) + payload.ljust(MAX_PAYLOAD, b'\0'))
+        index[adx] = len(slots)
+    header = _header.pack(MAGIC, VERSION, 0, SLOT_SIZE, len(slots))
+    return header + _index.pack(*index) + b''.join(slots)
+
+def saveImage(fn, image):
+    with open(fn, 'wb') as f:
+        f.write(packImage(image))
+
+def loadImage(fn):
+    'return an image file as an {adx: bytes} dict'
+    with EepromImage(fn) as img:
+        return dict(img.items())
+
+class EepromImage:
+    'read-only, mmap backed view of a binary image file; behaves like a {adx: bytes} dict'
+    def __init__(self, fn):
+        self.fn = fn
+        with open(fn, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        if len(self._mm) < DATA_OFFSET:
+            self.close()
+            raise ImageError(f'{fn}: too short for an image file')
+        magic, version, _, slotSize, slotCount = _header.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ImageError(f'{fn}: not a version {VERSION} image file')
+        if len(self._mm) < DATA_OFFSET + slotSize * slotCount:
+            self.close()
+            raise ImageError(f'{fn}: truncated')
+        self._slotSize = slotSize
+        self._slotCount = slotCount
+        self._index = _index.unpack_from(self._mm, _header.size)
+
+    def _slot(self, adx):
+        slot = self._index[adx] if 0 <= adx <= 0xFF else 0
+        if not slot:
+            raise KeyError(adx)
+        offset = DATA_OFFSET + (slot - 1) * self._slotSize
+        _, length = _slotHeader.unpack_from(self._mm, offset)
+        offset += _slotHeader.size
+        return self._mm[offset:offset + length]
+
+    def __getitem__(self, adx):
+        return self._slot(adx)
+
+    def get(self, adx, default = None):
+        try:
+            return self._slot(adx)
+        except KeyError:
+            return default
+
+    def __contains__(self, adx):
+        return 0 <= adx <= 0xFF and bool(self._index[adx])
+
+    def __len__(self):
+        return self._slotCount
+
+    def keys(self):
+        return [adx for adx, slot in enumerate(self._index) if slot]
+
+    __iter__ = lambda self: iter(self.keys())
+
+    def items(self):
+        return [(adx, self._slot(adx)) for adx in self.keys()]
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+def imageToData(image):
+    'decode an {adx: bytes} image to a value dict; addresses without a register are ignored'
+    byAdx = {reg.adx: reg for reg in makeEepromRegs()}
+    ret = {}
+    for adx in image.keys():
+        reg = byAdx.get(adx)
+        if reg is None: continue
+        reg.unpack(image[adx])
+        ret.update(dict(reg))
+    return ret
+
+def dataToImage(data):
+    'encode a value dict to an {adx: bytes} image; registers missing values, or read-only, are skipped'
+    ret = {}
+    for reg in makeEepromRegs():
+        valueNames = reg.valueNames
+        if not all(n in data for n in valueNames):
+            continue
+        try:
+            for n in valueNames:
+                reg.set(n, data[n])
+            ret[reg.adx] = reg.pack()
+        except ReadOnlyException:
+            pass
+    return ret
+
+def figToImage(text):
+    'convert .fig file contents (str) to an {adx: bytes} image'
+    return dataToImage(JBDPersist().deserialize(text))
+
+def imageToFig(image):
+    'convert an {adx: bytes} image to .fig file contents (bytes)'
+    return JBDPersist().serialize(imageToData(image))
+
+def main():
+    import argparse
+    p = argparse.ArgumentParser(description = 'convert between .fig files and binary EEPROM images')
+    p.add_argument('infile')
+    p.add_argument('outfile')
+    args = p.parse_args()
+
+    if args.infile.lower().endswith('.fig'):
+        with open(args.infile) as f:
+            saveImage(args.outfile, figToImage(f.read()))
+    else:
+        with EepromImage(args.infile) as img, open(args.outfile, 'wb') as f:
+            f.write(imageToFig(img))
+
+if __name__ == '__main__':
+    main()
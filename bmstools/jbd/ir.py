@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+# BMS Tools
+# Copyright (C) 2020 Eric Poulsen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Per-cell DC internal resistance from load steps.
+#
+#   e = IREstimator()
+#   e.update(basicInfo, cellInfo)      # per sample
+#   e.latest, e.history[3]             # mOhm
+#
+# Samples are kept in a sliding window.  When pack_ma changes by at least
+# minStep between two samples, the estimator waits for 'settle' more
+# samples and then fits cell mV = OCV + R * pack mA over the window, for
+# all cells at once (least squares; NumPy if installed).  Only the step
+# samples are fitted, so between steps update() is an append.  A fit is
+# discarded if the window's current range is below minStep or a cell's
+# fit is poor (r^2 < minR2).
+#
+# One estimator per pack; run one per pack in a fleet poller.
+
+import math
+import time
+from collections import deque
+
+from .optional import numpy as _numpy
+
+__all__ = ['IREstimator']
+
+def _fit(ma, volts):
+    '''least squares slope and r^2 of each column of volts (samples x cells)
+    against ma; returns ([slope, ...], [r2, ...])'''
+    np = _numpy()
+    if np is not None:
+        x = np.asarray(ma, dtype = np.float64)
+        y = np.asarray(volts, dtype = np.float64)
+        dx = x - x.mean()
+        dy = y - y.mean(axis = 0)
+        sxx = dx @ dx
+        sxy = dx @ dy
+        syy = (dy * dy).sum(axis = 0)
+        slope = sxy / sxx
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            r2 = np.where(syy > 0, sxy * sxy / (sxx * syy), 1.0)
+        return slope.tolist(), r2.tolist()
+
+    n = len(ma)
+    mx = sum(ma) / n
+    dx = [x - mx for x in ma]
+    sxx = sum(d * d for d in dx)
+    slopes, r2s = [], []
+    for cell in zip(*volts):
+        my = sum(cell) / n
+        dy = [y - my for y in cell]
+        sxy = sum(a * b for a, b in zip(dx, dy))
+        syy = sum(d * d for d in dy)
+        slopes.append(sxy / sxx)
+        r2s.append(sxy * sxy / (sxx * syy) if syy else 1.0)
+    return slopes, r2s
+
+class IREstimator:
+    'streaming per-cell DC internal resistance; see the module comment'
+    def __init__(self, window = 10, settle = 3, minStep = 1000, minR2 = .8, historyLen = 1000):
+        self.window = window
+        self.settle = settle
+        self.minStep = minStep   # mA
+        self.minR2 = minR2
+        self.historyLen = historyLen
+        self.samples = deque(maxlen = window) # (t, ma, [cell mv, ...])
+        self.pending = None  # samples left until a detected step is fitted
+        self.steps = 0
+        self.fits = 0
+        self.latest = []     # mOhm per cell, None until fitted
+        self.history = []    # per cell deque of (t, mOhm)
+
+    def update(self, basicInfo, cellInfo, t = None):
+        '''add one sample; t defaults to time.monotonic().  Returns the
+        per-cell mOhm list if a fit was made, else None.'''
+        t = time.monotonic() if t is None else t
+        ma = basicInfo['pack_ma']
+        volts = list(cellInfo.values())
+        samples = self.samples
+        if samples and len(samples[-1][2]) != len(volts):
+            samples.clear() # cell count changed
+            self.pending = None
+        if samples and abs(ma - samples[-1][1]) >= self.minStep and self.pending is None:
+            self.steps += 1
+            self.pending = self.settle
+        samples.append((t, ma, volts))
+        if self.pending is None: return None
+        if self.pending > 0:
+            self.pending -= 1
+            return None
+        self.pending = None
+        return self._fit(t)
+
+    def _fit(self, t):
+        ma = [s[1] for s in self.samples]
+        if max(ma) - min(ma) < self.minStep: return None
+        slopes, r2s = _fit(ma, [s[2] for s in self.samples])
+        while len(self.history) < len(slopes):
+            self.history.append(deque(maxlen = self.historyLen))
+            self.latest.append(None)
+        ret = []
+        for i, (slope, r2) in enumerate(zip(slopes, r2s)):
+            # mV per mA is Ohm; V rises with (charge positive) current
+            mohm = slope * 1000
+            if r2 < self.minR2 or mohm <= 0 or math.isnan(mohm):
+                ret.append(None)
+                continue
+            self.latest[i] = mohm
+            self.history[i].append((t, mohm))
+            ret.append(mohm)
+        self.fits += 1
+        return ret
+
+    def trend(self, cell, n = None):
+        '''least squares slope of the cell's last n IR estimates in mOhm per
+        day, or None with fewer than 2'''
+        h = list(self.history[cell])[-n:] if n else list(self.history[cell])
+        if len(h) < 2: return None
+        ts = [x[0] / 86400 for x in h]
+        if max(ts) == min(ts): return None
+        return _fit(ts, [[x[1]] for x in h])[0][0]
+
+    def summary(self):
+        return {f'cell{i}_mohm': v for i, v in enumerate(self.latest)}
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}: {self.steps} steps, {self.fits} fits>'
@@ -16,7 +16,6 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import serial
 import time
 import struct
 import threading
@@ -25,6 +24,7 @@ import sys
 from enum import Enum
 from functools import partial
 from . import persist
+from . import regmap
 
 from .registers import (BaseReg, Unit, DateReg, IntReg, 
                         TempReg, TempRegRO, DelayReg, 
@@ -72,87 +72,13 @@ class JBD:
         self.writeNVMOnExit = False
         self.bkgReadThread = None
         self.bkgReadQ = queue.Queue()
+        self.capture = None # capture.FrameCapture; see FrameCapture.attach()
+        self.capturePort = 0
 
-        self.eeprom_regs = [
-            ### EEPROM settings
-            ## Settings
-            # Basic Parameters
-            IntReg('covp', 0x24, Unit.MV, 1),
-            IntReg('covp_rel', 0x25, Unit.MV, 1),
-            IntReg('cuvp', 0x26, Unit.MV, 1),
-            IntReg('cuvp_rel', 0x27, Unit.MV, 1),
-            IntReg('povp', 0x20, Unit.MV, 10),
-            IntReg('povp_rel', 0x21, Unit.MV, 10),
-            IntReg('puvp', 0x22, Unit.MV, 10),
-            IntReg('puvp_rel', 0x23, Unit.MV, 10),
-            TempReg('chgot', 0x18),
-            TempReg('chgot_rel', 0x19),
-            TempReg('chgut', 0x1a),
-            TempReg('chgut_rel', 0x1b),
-            TempReg('dsgot', 0x1c),
-            TempReg('dsgot_rel', 0x1d),
-            TempReg('dsgut', 0x1e),
-            TempReg('dsgut_rel', 0x1f),
-            IntReg('chgoc', 0x28, Unit.MA, 10),
-            IntReg('dsgoc', 0x29, Unit.MA, 10),
-            DelayReg('cell_v_delays', 0x3d, 'cuvp_delay', 'covp_delay'),
-            DelayReg('pack_v_delays', 0x3c, 'puvp_delay', 'povp_delay'),
-            DelayReg('chg_t_delays', 0x3a, 'chgut_delay', 'chgot_delay'),
-            DelayReg('dsg_t_delays', 0x3b, 'dsgut_delay', 'dsgot_delay'),
-            DelayReg('chgoc_delays', 0x3e, 'chgoc_delay', 'chgoc_rel'),
-            DelayReg('dsgoc_delays', 0x3f, 'dsgoc_delay', 'dsgoc_rel'),
-
-            # High Protection Configuration
-            IntReg('covp_high', 0x36, Unit.MV, 1),
-            IntReg('cuvp_high', 0x37, Unit.MV, 1),
-            ScDsgoc2Reg('sc_dsgoc2', 0x38),
-            CxvpHighDelayScRelReg('cxvp_high_delay_sc_rel', 0x39),
-
-            # Function Configuration
-            BitfieldReg('func_config', 0x2d, 'switch', 'scrl', 'balance_en', 'chg_balance_en', 'led_en', 'led_num'),
-
-            # NTC Configuration
-            BitfieldReg('ntc_config', 0x2e, *(f'ntc{i+1}' for i in range(8))),
-
-            # Balance Configuration
-            IntReg('bal_start', 0x2a, Unit.MV, 1),
-            IntReg('bal_window', 0x2b, Unit.MV, 1),
-
-            # Other Configuration
-            IntReg('shunt_res', 0x2c, Unit.MO, .1),
-            IntReg('cell_cnt', 0x2f, int, 1),
-            IntReg('cycle_cnt', 0x17, int, 1),
-            IntReg('serial_num', 0x16, int, 1),
-            StringReg('mfg_name', 0xa0),
-            StringReg('device_name', 0xa1),
-            StringReg('barcode', 0xa2),
-            DateReg('mfg_date', 0x15),
-
-            # Capacity Config
-            IntReg('design_cap', 0x10, Unit.MAH, 10), 
-            IntReg('cycle_cap', 0x11, Unit.MAH, 10),
-            IntReg('dsg_rate', 0x14, Unit.PCT, .1), # presuming this means rate of self-discharge
-            IntReg('cap_100', 0x12, Unit.MV, 1), # AKA "Full Chg Vol"
-            IntReg('cap_80', 0x32, Unit.MV, 1),
-            IntReg('cap_60', 0x33, Unit.MV, 1),
-            IntReg('cap_40', 0x34, Unit.MV, 1),
-            IntReg('cap_20', 0x35, Unit.MV, 1),
-            IntReg('cap_0', 0x13, Unit.MV, 1), # AKA "End of Dsg VOL"
-            IntReg('fet_ctrl', 0x30, Unit.S, 1),
-            IntReg('led_timer', 0x31, Unit.S, 1),
-
-            # Errors
-            ErrorCountReg('error_cnts', 0xaa),
-        ]
-        self.eeprom_reg_by_valuename = {}
-        self.eeprom_reg_by_adx = {}
-        self.eeprom_reg_by_regname = {}
-        for reg in self.eeprom_regs:
-            map = {k:reg for k in reg.valueNames}
-            self.eeprom_reg_by_valuename.update(map)
-            self.eeprom_reg_by_adx[reg.adx] = reg
-            self.eeprom_reg_by_regname[reg.regName] = reg
-
+        self.eeprom_regs = regmap.makeEepromRegs()
+        (self.eeprom_reg_by_valuename,
+         self.eeprom_reg_by_adx,
+         self.eeprom_reg_by_regname) = regmap.indexRegs(self.eeprom_regs)
 
         self.basicInfoReg = BasicInfoReg('basic_info', 0x03)
         self.cellInfoReg = CellInfoReg('cell_info', 0x04)
@@ -286,11 +212,17 @@ class JBD:
             if byte == self.END and len(d) >= 7 + msgLen: 
                 complete = True
                 break
+        capture = self.capture # FrameCapture.close() may clear it from another thread
         if d and complete:
             self.dbgPrint('readPacket:', self.toHex(d))
+            d = bytes(d)
+            if capture:
+                capture.frame(d, self.capturePort)
             reg = d[1]
             ok = not d[2]
-            return ok, reg, self.extractPayload(bytes(d))
+            return ok, reg, self.extractPayload(d)
+        if d and capture:
+            capture.frame(bytes(d), self.capturePort, complete = False)
         self.dbgPrint(f'readPacket failed with {len(d)} bytes')
         return False, None, None
 
@@ -393,6 +325,37 @@ class JBD:
                 ret.update(dict(reg))
             return ret
 
+    def readRange(self, start, end, progressFunc = None):
+        '''read every address from start to end (inclusive) in one factory
+        session; returns a {adx: payload bytes} image.  Addresses the BMS
+        rejects are left out of the image.'''
+        if not 0 <= start <= end <= 0xFF:
+            raise ValueError('address range must be within 0x00 - 0xFF')
+        with self.factoryContext():
+            ret = {}
+            numAdx = end - start + 1
+            if progressFunc: progressFunc(0)
+
+            for i, adx in enumerate(range(start, end + 1)):
+                cmd = self.readCmd(adx)
+                self.s.write(cmd)
+                ok, payload = self.readPacket()
+                if payload is None: raise TimeoutError()
+                if ok: ret[adx] = bytes(payload)
+                if progressFunc: progressFunc(int((i + 1) / numAdx * 100))
+            return ret
+
+    def decodeEeprom(self, image):
+        '''decode a {adx: payload bytes} image, e.g. from readRange(), through
+        the EEPROM registers; addresses without a register are ignored'''
+        ret = {}
+        for adx, payload in image.items():
+            reg = self.eeprom_reg_by_adx.get(adx)
+            if reg is None: continue
+            reg.unpack(payload)
+            ret.update(dict(reg))
+        return ret
+
     def writeEeprom(self, data, progressFunc = None):
         with self.factoryContext(True):
             ret = {}
@@ -659,38 +622,5 @@ class JBD:
             if payload is None: raise TimeoutError()
 
 def checkRegNames():
-    jbd = JBD(None)
-    errors = []
-    valueNamesToRegs = {}
-    regNameCounts = {}
-    # These have duplicate fields, but we don't care.
-    ignore=BasicInfoReg,
-    for reg in jbd.eeprom_regs:
-        if reg.__class__ in ignore: continue
-        if reg.regName not in regNameCounts:
-            regNameCounts[reg.regName] = 1
-        else:
-            regNameCounts[reg.regName] += 1
-
-    for regName, count in regNameCounts.items():
-        if count == 1: continue
-        errors.append(f'register name {regName} occurs {count} times')
-
-    for reg in jbd.eeprom_regs:
-        if reg.__class__ in ignore: continue
-        valueNames = reg.valueNames
-        for n in valueNames:
-            if n in valueNamesToRegs:
-                otherReg = valueNamesToRegs[n]
-                errors.append(f'duplicate value name "{n}" in regs {reg.regName} and {otherReg.regName}')
-            else:
-                valueNamesToRegs[n] = reg
-    return errors
-
-# sanity check for reg setup
-errors = checkRegNames()
-if errors:
-    for error in errors:
-        print(error)
-    raise RuntimeError('register errors')
-del errors
\ No newline at end of file
+    'sanity check for reg setup; see regmap.checkRegNames'
+    return regmap.checkRegNames()
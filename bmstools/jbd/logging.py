@@ -16,9 +16,172 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from xlsxwriter import Workbook
 import os
+import sys
 import time
+import queue
+import atexit
+import weakref
+import threading
+
+from .registers import BasicInfoReg
+
+class LogWriter:
+    '''background writer thread; loggers hand it samples through a bounded
+    queue, and it writes them in batches, flushing every flushInterval
+    seconds or flushRows rows, whichever comes first.  One LogWriter can
+    be shared by several loggers.
+
+    When the queue is full, samples are dropped and counted in dropped,
+    unless block is set, in which case log() waits (back-pressure).'''
+
+    _CLOSE = object()
+    _STOP = object()
+
+    def __init__(self, queueSize = 1000, flushInterval = 1.0, flushRows = 100, block = False):
+        self.flushInterval = flushInterval
+        self.flushRows = flushRows
+        self.block = block
+        self.dropped = 0
+        self.q = queue.Queue(queueSize)
+        self.thread = threading.Thread(target = self._run, name = 'LogWriter', daemon = True)
+        self.thread.start()
+
+    def put(self, logger, sample):
+        'queue a sample for logger; returns False if it was dropped'
+        try:
+            self.q.put((logger, sample), block = self.block)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger.dropped += 1
+            return False
+
+    def closeLogger(self, logger, timeout = None):
+        '''write out everything queued for logger, then close it; waits for
+        completion.  Returns False if that didn't happen within timeout, or
+        can't because the writer thread has stopped.'''
+        if threading.current_thread() is self.thread:
+            # e.g. Logger.__del__ run on this thread; nothing can be queued behind us
+            self._call(logger._flush)
+            self._call(logger._close)
+            return True
+        if not self.thread.is_alive():
+            return False
+        done = threading.Event()
+        self.q.put((logger, (self._CLOSE, done)))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not done.wait(.1):
+            if not self.thread.is_alive(): return False
+            if deadline is not None and time.monotonic() >= deadline: return False
+        return True
+
+    def stop(self, timeout = None):
+        self.q.put((None, self._STOP))
+        self.thread.join(timeout)
+
+    def _run(self):
+        dirty = set()
+        rows = 0
+        nextFlush = time.monotonic() + self.flushInterval
+        while True:
+            try:
+                logger, sample = self.q.get(timeout = max(0, nextFlush - time.monotonic()))
+            except queue.Empty:
+                logger, sample = None, None
+
+            if sample is self._STOP:
+                for l in dirty:
+                    self._call(l._flush)
+                return
+            if type(sample) is tuple and sample and sample[0] is self._CLOSE:
+                self._call(logger._flush)
+                self._call(logger._close)
+                dirty.discard(logger)
+                sample[1].set()
+            elif sample is not None:
+                self._call(logger._write, sample)
+                dirty.add(logger)
+                rows += 1
+
+            if rows >= self.flushRows or time.monotonic() >= nextFlush:
+                for l in dirty:
+                    self._call(l._flush)
+                dirty.clear()
+                rows = 0
+                nextFlush = time.monotonic() + self.flushInterval
+
+    @staticmethod
+    def _call(func, *args):
+        # a failing logger must not take the writer thread down
+        try:
+            func(*args)
+        except Exception as e:
+            print(f'log writer: {e!r}', file = sys.stderr)
+
+class Rollup:
+    '''incremental min/mean/max of each value over fixed periods of
+    period seconds, aligned to the epoch.  add() returns the finished
+    row when a sample starts a new period.'''
+    def __init__(self, period, names):
+        self.period = period
+        self.names = list(names)
+        self.start = None
+        self._reset()
+
+    def _reset(self):
+        n = len(self.names)
+        self.cnt = [0] * n
+        self.sum = [0.0] * n
+        self.min = [None] * n
+        self.max = [None] * n
+
+    @property
+    def header(self):
+        return ['Date', 'time', 'samples',
+                *[f'{n}_{s}' for n in self.names for s in ('min', 'mean', 'max')]]
+
+    def row(self):
+        'the current, possibly partial, period as a row; None if it is empty'
+        if self.start is None or not any(self.cnt):
+            return None
+        row = [*Logger.dateGen(self.start), max(self.cnt)]
+        for cnt, sum_, min_, max_ in zip(self.cnt, self.sum, self.min, self.max):
+            row += [min_, round(sum_ / cnt, 3), max_] if cnt else ['', '', '']
+        return row
+
+    def add(self, t, values):
+        start = t - t % self.period
+        ret = None
+        if start != self.start:
+            ret = self.row()
+            self.start = start
+            self._reset()
+        cnt, sum_, min_, max_ = self.cnt, self.sum, self.min, self.max
+        for i, v in enumerate(values):
+            if v is None: continue
+            cnt[i] += 1
+            sum_[i] += v
+            if min_[i] is None or v < min_[i]: min_[i] = v
+            if max_[i] is None or v > max_[i]: max_[i] = v
+        return ret
+
+class _CsvSink:
+    'a plain CSV side file (rollups, events); appended to, header written if new'
+    def __init__(self, fn, header):
+        self.fn = fn
+        self.f = open(fn, 'a')
+        if not self.f.tell():
+            self.write(header)
+
+    def write(self, row):
+        self.f.write(','.join(['' if i is None else str(i) for i in row])+'\n')
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
 
 class Logger:
     'currently written to be compatible with the JBD official app logging'
@@ -64,40 +227,339 @@ class Logger:
                     'Cycle Count'] 
     headerNames3 = ['CHG Fet Status', 'DSG Fet Status', 
                     'ProtectStatus', 'BalanceStatus']
+
+    eventHeader = ['Date', 'time', 'epoch', 'event', 'ProtectStatus', 'CHG Fet Status', 'DSG Fet Status']
     
-    def __init__(self, fn):
+    xlsxMaxRows = 1048576 # per worksheet
+
+    def __init__(self, fn, writer = None, rollups = (), events = None,
+                 segmentBytes = None, segmentSeconds = None, compress = True, keepRaw = None,
+                 pack = None, raw = False, width = None):
+        '''writer is a LogWriter, which may be shared with other loggers;
+        by default each logger gets its own.
+
+        rollups is a sequence of periods in seconds, e.g. (60, 3600); each
+        gets a <name>.<period>.csv file of per-period min/mean/max of every
+        pack, NTC and cell value.  events writes fault and FET transitions
+        at full resolution to <name>.events.csv; on by default with rollups.
+
+        segmentBytes / segmentSeconds split the log into numbered segments,
+        <name>.0001.csv etc., listed in <name>.index.csv.  Existing segments
+        are kept and numbering continues after them.  Closed csv / jbl
+        segments are gzipped in the background unless compress is False,
+        and segments older than keepRaw seconds are deleted.  Rollup and
+        event files are appended to as well.  Without segments, an existing
+        file is overwritten, along with its rollup and event files.
+
+        .sqlite, .sqlite3 and .db files use the SQLite backend; those are
+        appended to and not segmented, and samples are tagged with pack.
+
+        raw writes csv / xlsx rows as plain numbers under readBasicInfo()
+        names, with epoch time in a 't' column and the monotonic clock it
+        was taken from in 'mono' (as .jbl and SQLite logs do), instead of the vendor
+        compatible strings.  width, (cells, NTCs), fixes the raw columns
+        instead of taking them from the first sample.'''
         self.logFilename = fn
         print(f'logfile name: {fn}')
-        if os.path.exists(fn):
-            os.remove(fn)
+        self.dropped = 0
+        self.xlsx = fn.lower().endswith('.xls') or fn.lower().endswith('.xlsx')
+        self.binary = fn.lower().endswith('.jbl')
+        self.sqlite = fn.lower().endswith(('.sqlite', '.sqlite3', '.db'))
+        self.pack = pack
+        self.raw = raw
+        self.width = width
+        self.fn = fn
+        self._anchorClock()
+        self.segmentBytes = segmentBytes
+        self.segmentSeconds = segmentSeconds
+        self.segmented = bool(segmentBytes or segmentSeconds)
+        if self.segmented and self.sqlite:
+            raise ValueError('SQLite logs are not segmented')
+        self.compress = compress and not self.xlsx # xlsx is already zipped
+        self.keepRaw = keepRaw
+        self.compressThreads = []
+        if self.segmented:
+            self.segments = self.readIndex(fn)
+            self.segmentNum = max([self._segmentNum(seg['segment']) for seg in self.segments] +
+                                  [self._segmentNum(f) for f in os.listdir(os.path.dirname(fn) or '.')
+                                   if self._segmentNum(f) is not None] + [0]) + 1
+            self._open(self.segmentFn(fn, self.segmentNum))
+        elif self.sqlite:
+            self._open(fn)
+        else:
+            # .tidx: LogReader's time index; side files go with the log they summarise
+            for i in (fn, fn + '.tidx', self._sideFn('events'), *[self._sideFn(f'{p}s') for p in rollups]):
+                if os.path.exists(i):
+                    os.remove(i)
+            self._open(fn)
+        self.rollupPeriods = tuple(rollups)
+        self.rollups = None # [(Rollup, _CsvSink), ...], created with the first sample
+        self.events = None
+        self.eventsEnabled = bool(rollups) if events is None else events
+        self.lastState = None
+        self.ownWriter = writer is None
+        self.writer = writer or LogWriter()
+        _openLoggers.add(self)
+
+    @staticmethod
+    def segmentFn(fn, num):
+        base, ext = os.path.splitext(fn)
+        return f'{base}.{num:04d}{ext}'
+
+    @staticmethod
+    def indexFn(fn):
+        return f'{os.path.splitext(fn)[0]}.index.csv'
+
+    @classmethod
+    def readIndex(cls, fn):
+        '''return the closed segments of a segmented log as [{segment, start,
+        end, rows}, ...], oldest first; segment is the uncompressed file name'''
+        try:
+            with open(cls.indexFn(fn)) as f:
+                lines = f.read().splitlines()[1:]
+        except FileNotFoundError:
+            return []
+        ret = []
+        for line in lines:
+            segment, start, end, rows = line.split(',')
+            ret.append({'segment': segment, 'start': float(start), 'end': float(end), 'rows': int(rows)})
+        return ret
+
+    def _segmentNum(self, name):
+        'segment number of a file name belonging to this log, else None'
+        base, ext = os.path.splitext(os.path.basename(self.fn))
+        name = os.path.basename(name)
+        if name.endswith('.gz'): name = name[:-3]
+        if not (name.startswith(base + '.') and name.endswith(ext)): return None
+        num = name[len(base) + 1:len(name) - len(ext)]
+        return int(num) if num.isdigit() else None
+
+    def _open(self, fn):
+        self.segmentName = fn
         self.headerWritten = False
+        self.header = None
         self.rowNum = 0
-        if fn.lower().endswith('.xls') or fn.lower().endswith('.xlsx'):
+        self.sheetNum = 0
+        self.ws = None
+        self.segStart = self.segEnd = None
+        self.segRows = 0
+        if self.binary:
+            from .binlog import BinLogWriter
+            self.logFileHandle = BinLogWriter(fn)
+        elif self.sqlite:
+            from .sqlitelog import SqliteLog
+            self.logFileHandle = SqliteLog(fn, self.pack)
+        elif self.xlsx:
+            from xlsxwriter import Workbook # optional; only needed for xlsx logs
             self.logFileHandle = Workbook(fn, {'constant_memory': True})
         else:
             self.logFileHandle = open(fn, 'w+')
-        self.fn = fn
+
+    def _segmentFull(self, t):
+        if not self.segRows: return False
+        if self.segmentSeconds and t - self.segStart >= self.segmentSeconds: return True
+        if self.segmentBytes and not self.xlsx:
+            return self.logFileHandle.tell() >= self.segmentBytes
+        return False
+
+    def _closeSegment(self):
+        self.logFileHandle.close()
+        self.logFileHandle = None
+        if not self.segmented: return
+        if not self.segRows:
+            os.remove(self.segmentName)
+            return
+        seg = {'segment': os.path.basename(self.segmentName),
+               'start': self.segStart, 'end': self.segEnd, 'rows': self.segRows}
+        self.segments.append(seg)
+        indexFn = self.indexFn(self.fn)
+        new = not os.path.exists(indexFn)
+        with open(indexFn, 'a') as f:
+            if new: f.write('segment,start,end,rows\n')
+            f.write(f"{seg['segment']},{seg['start']:.3f},{seg['end']:.3f},{seg['rows']}\n")
+        if self.compress:
+            th = threading.Thread(target = self._compress, args = (self.segmentName,),
+                                  name = 'LogCompress', daemon = True)
+            th.start()
+            self.compressThreads = [i for i in self.compressThreads if i.is_alive()] + [th]
+
+    @staticmethod
+    def _compress(fn):
+        import gzip, shutil
+        try:
+            with open(fn, 'rb') as src, gzip.open(fn + '.tmp', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(fn + '.tmp', fn + '.gz')
+            os.remove(fn)
+        except OSError as e:
+            print(f'compressing {fn}: {e!r}', file = sys.stderr)
+
+    def _expire(self, now):
+        '''delete raw segments that ended more than keepRaw seconds before
+        now, and drop them from the index'''
+        if self.keepRaw is None: return
+        d = os.path.dirname(self.fn)
+        n = 0
+        for seg in self.segments:
+            if seg['end'] >= now - self.keepRaw: break
+            for fn in (seg['segment'], seg['segment'] + '.gz'):
+                fn = os.path.join(d, fn)
+                if os.path.exists(fn):
+                    os.remove(fn)
+            n += 1
+        if n:
+            del self.segments[:n]
+            self._writeIndex()
+
+    def _writeIndex(self):
+        'rewrite the index from self.segments'
+        indexFn = self.indexFn(self.fn)
+        with open(indexFn + '.tmp', 'w') as f:
+            f.write('segment,start,end,rows\n')
+            for seg in self.segments:
+                f.write(f"{seg['segment']},{seg['start']:.3f},{seg['end']:.3f},{seg['rows']}\n")
+        os.replace(indexFn + '.tmp', indexFn)
+
+    def _rotate(self, t):
+        self._closeSegment()
+        self._expire(t)
+        self.segmentNum += 1
+        self._open(self.segmentFn(self.fn, self.segmentNum))
+
+    # these run on the writer thread
+
+    def _write(self, sample):
+        # sample is (t, basicInfo, cellInfo), optionally followed by pack
+        # (FleetLogger) and the monotonic time t was taken from (log())
+        t, basicInfo, cellInfo = sample[:3]
+        pack = sample[3] if len(sample) > 3 else None
+        mono = sample[4] if len(sample) > 4 else None
+        if self.segmented and self._segmentFull(t):
+            self._rotate(t)
+        if self.segStart is None: self.segStart = t
+        self.segEnd = t
+        self.segRows += 1
+        if self.sqlite:
+            self.logFileHandle.write(t, basicInfo, cellInfo, pack, mono)
+        elif self.binary:
+            self.logFileHandle.write(t, basicInfo, cellInfo, mono)
+        elif self.raw:
+            self._logRaw(t, basicInfo, cellInfo, pack, mono)
+        else:
+            self._logCompat(t, basicInfo, cellInfo)
+        if self.rollupPeriods:
+            self._rollup(t, basicInfo, cellInfo)
+        if self.eventsEnabled:
+            self._event(t, basicInfo, cellInfo)
+
+    def _flush(self):
+        if self.logFileHandle and not self.xlsx:
+            self.logFileHandle.flush()
+        for sink in self._sinks():
+            sink.flush()
+
+    def _close(self):
+        if not self.logFileHandle: return
+        for rollup, sink in self.rollups or ():
+            row = rollup.row()
+            if row: sink.write(row)
+        for sink in self._sinks():
+            sink.close()
+        self._closeSegment()
+        print(self.fn, 'closed')
+
+    def _sinks(self):
+        sinks = [sink for _, sink in self.rollups or ()]
+        if self.events: sinks.append(self.events)
+        return sinks
+
+    def _sideFn(self, suffix):
+        return f'{os.path.splitext(self.fn)[0]}.{suffix}.csv'
+
+    @staticmethod
+    def rollupValues(basicInfo, cellInfo):
+        'the (names, values) rollups aggregate'
+        ntcs = [f'ntc{i}' for i in range(basicInfo['ntc_cnt'])]
+        names = ['pack_mv', 'pack_ma', 'cap_pct', 'cur_cap', *ntcs, *cellInfo.keys()]
+        values = [basicInfo['pack_mv'], basicInfo['pack_ma'], basicInfo['cap_pct'], basicInfo['cur_cap'],
+                  *[basicInfo.get(n) for n in ntcs], *cellInfo.values()]
+        return names, values
+
+    def _rollup(self, t, basicInfo, cellInfo):
+        names, values = self.rollupValues(basicInfo, cellInfo)
+        if self.rollups is None:
+            self.rollups = []
+            for period in self.rollupPeriods:
+                rollup = Rollup(period, names)
+                self.rollups.append((rollup, _CsvSink(self._sideFn(f'{period}s'), rollup.header)))
+        for rollup, sink in self.rollups:
+            row = rollup.add(t, values[:len(rollup.names)])
+            if row: sink.write(row)
+
+    def _event(self, t, basicInfo, cellInfo):
+        state = basicInfo['fault_raw'], bool(basicInfo['chg_fet_en']), bool(basicInfo['dsg_fet_en'])
+        if state == self.lastState: return
+        if self.events is None:
+            self.events = _CsvSink(self._sideFn('events'), self.eventHeader)
+        if self.lastState is None:
+            event = 'start'
+        else:
+            changed = state[0] ^ self.lastState[0]
+            event = [('+' if state[0] & (1 << bit) else '-') + name
+                     for bit, name in enumerate(BasicInfoReg._faultBits) if changed & (1 << bit)]
+            for name, old, new in zip(BasicInfoReg._fetBits, self.lastState[1:], state[1:]):
+                if old != new:
+                    event.append(f'{name} {self.boolConvCompat(new)}')
+            event = ' '.join(event)
+        self.lastState = state
+        self.events.write((*self.dateGen(t), f'{t:.3f}', event,
+                           self.faultConvCompat(state[0]),
+                           self.boolConvCompat(state[1]), self.boolConvCompat(state[2])))
 
     def _logRow(self, row):
         if not self.logFileHandle: return
         h = self.logFileHandle
-        if isinstance(h, Workbook):
-            worksheets = h.worksheets()
-            if not worksheets:
-                name = os.path.basename(os.path.splitext(self.fn)[0])
-                ws = h.add_worksheet(name) 
-            else:
-                ws = worksheets[0]
-
+        if self.xlsx:
+            if self.ws is None or self.rowNum >= self.xlsxMaxRows:
+                # roll over to a new worksheet before the row limit, repeating the header
+                self.sheetNum += 1
+                name = os.path.basename(os.path.splitext(self.fn)[0])[:24]
+                self.ws = h.add_worksheet(name if self.sheetNum == 1 else f'{name} {self.sheetNum}')
+                self.rowNum = 0
+                if self.header and row is not self.header:
+                    for col, data in enumerate(self.header):
+                        self.ws.write(self.rowNum, col, data)
+                    self.rowNum += 1
             for col, data in enumerate(row):
-                ws.write(self.rowNum, col, data)
+                self.ws.write(self.rowNum, col, data)
         else:
             h.write(','.join([str(i) for i in row])+'\n')
-            h.flush()
 
         self.rowNum += 1
 
-    def _logCompat(self, basicInfo, cellInfo):
+    rawColumns = ('pack_mv', 'pack_ma', 'cur_cap', 'full_cap', 'cap_pct', 'cycle_cnt',
+                  'chg_fet_en', 'dsg_fet_en', 'fault_raw', 'bal_raw')
+
+    def _logRaw(self, t, basicInfo, cellInfo, pack = None, mono = None):
+        pack = self.pack if pack is None else pack
+        if not self.headerWritten:
+            self.headerWritten = True
+            cellCnt, ntcCnt = self.width or (len(cellInfo), basicInfo['ntc_cnt'])
+            self.rawNtcs = [f'ntc{i}' for i in range(ntcCnt)]
+            self.rawCells = [f'cell{i}_mv' for i in range(cellCnt)]
+            self.rawPack = pack is not None
+            h = ('t', 'mono', *(('pack',) if self.rawPack else ()),
+                 *self.rawColumns, *self.rawNtcs, *self.rawCells)
+            self.header = h
+            self._logRow(h)
+        b = basicInfo
+        row = (round(t, 3), '' if mono is None else round(mono, 3), *((pack,) if self.rawPack else ()),
+               *[int(b[n]) for n in self.rawColumns],
+               *['' if b.get(n) is None else b[n] for n in self.rawNtcs],
+               *[cellInfo.get(n, '') for n in self.rawCells])
+        self._logRow(row)
+
+    def _logCompat(self, t, basicInfo, cellInfo):
         cellInfo = list(cellInfo.values())
         cellCnt = len(cellInfo)
         ntcCnt = basicInfo['ntc_cnt']
@@ -108,9 +570,10 @@ class Logger:
                  *self.headerNames2,
                  *[f'temp{i+1}' for i in range(ntcCnt)],
                  * self.headerNames3)
+            self.header = h
             self._logRow(h)
         row = (
-            *self.dateGen(),
+            *self.dateGen(t),
             self.pvConvCompat(basicInfo['pack_mv']),
             self.piConvCompat(basicInfo['pack_ma']),
             *[self.cvConvCompat(i) for i in cellInfo],
@@ -129,22 +592,133 @@ class Logger:
         )
         self._logRow(row)
 
-    def log(self, basicInfo, cellInfo):
-        self._logCompat(basicInfo, cellInfo)
+    # sample times come from time.monotonic(), anchored to time.time() and
+    # re-anchored every clockResync seconds: one cheap clock read per sample,
+    # and wall clock steps can't reorder rows in between
+    clockResync = 3600
 
-    @staticmethod
-    def dateGen():
-        t = time.localtime()
-        return time.strftime('%Y-%m-%d', t), time.strftime('%H:%M:%S', t)
+    def _anchorClock(self):
+        self.monoAnchor = time.monotonic()
+        self.epochAnchor = time.time()
 
-    def close(self):
-        if not self.logFileHandle: return
-        self.logFileHandle.close()
-        self.logFileHandle = None
-        print(self.fn, 'closed')
+    def clock(self):
+        'return the (monotonic, epoch) time pair for a new sample'
+        mono = time.monotonic()
+        if mono - self.monoAnchor >= self.clockResync:
+            self._anchorClock()
+        return mono, self.epochAnchor + (mono - self.monoAnchor)
+
+    def log(self, basicInfo, cellInfo, pack = None):
+        '''queue a sample for the writer thread; never blocks unless the
+        writer was made with block = True.  pack tags the sample in raw and
+        SQLite logs.'''
+        if not self.writer: return
+        mono, t = self.clock()
+        self.writer.put(self, (t, basicInfo, cellInfo, pack, mono))
+
+    _dateCache = (None, None) # (whole second, (date, time))
+
+    @classmethod
+    def dateGen(cls, t = None):
+        'local (date, time) strings for epoch time t; formatted once per second'
+        sec = int(time.time() if t is None else t // 1)
+        cached = cls._dateCache
+        if cached[0] == sec:
+            return cached[1]
+        lt = time.localtime(sec)
+        ret = time.strftime('%Y-%m-%d', lt), time.strftime('%H:%M:%S', lt)
+        cls._dateCache = sec, ret
+        return ret
+
+    def close(self, timeout = None):
+        'write out queued samples and close the file'
+        writer = getattr(self, 'writer', None)
+        if not writer: return
+        self.writer = None
+        _openLoggers.discard(self)
+        if not writer.closeLogger(self, timeout) and not writer.thread.is_alive():
+            # the writer is gone; close the file here with what reached it
+            LogWriter._call(self._flush)
+            LogWriter._call(self._close)
+        if self.ownWriter:
+            writer.stop(timeout)
+        for th in self.compressThreads:
+            th.join()
+        if self.dropped:
+            print(f'{self.fn}: {self.dropped} samples dropped')
 
     def __del__(self):
-        self.close()
+        self.close(self.exitTimeout)
+
+    exitTimeout = 10 # seconds per logger to write out its queue at exit
+
+# Loggers not yet closed; at interpreter exit their queued samples are
+# written out, as LogWriter threads are daemons and would just be stopped.
+_openLoggers = weakref.WeakSet()
+
+@atexit.register
+def _closeLoggers():
+    for logger in list(_openLoggers):
+        logger.close(logger.exitTimeout)
+
+class FleetLogger:
+    '''logs samples from several packs through one shared LogWriter.
+
+    mode 'streams' gives each pack its own Logger and file,
+    <name>.<pack><ext>, created on the pack's first sample; each file has
+    its own header, so packs may differ in cell count.  mode
+    'interleaved' writes a single stream: a SQLite log, or a raw csv /
+    xlsx log with a pack column, padded to maxCells cells and maxNtcs
+    NTCs so no pack forces a new header.  Other keyword arguments go to
+    Logger.'''
+
+    maxCells = 32 # bal_raw has 32 bits
+    maxNtcs = len(BasicInfoReg._ntcFields)
+
+    def __init__(self, fn, mode = 'streams', writer = None, **kwargs):
+        if mode not in ('streams', 'interleaved'):
+            raise ValueError(f'unknown mode {mode}')
+        self.fn = fn
+        self.mode = mode
+        self.kwargs = kwargs
+        self.ownWriter = writer is None
+        self.writer = writer or LogWriter()
+        self.loggers = {}
+        self.logger = None
+        if mode == 'interleaved':
+            if fn.lower().endswith('.jbl'):
+                raise ValueError('binary logs hold one pack; use streams mode')
+            kwargs = dict(kwargs, raw = True, width = (self.maxCells, self.maxNtcs))
+            self.logger = Logger(fn, self.writer, **kwargs)
+
+    @staticmethod
+    def streamFn(fn, pack):
+        base, ext = os.path.splitext(fn)
+        pack = ''.join(c if c.isalnum() or c in '-_' else '_' for c in str(pack))
+        return f'{base}.{pack}{ext}'
+
+    def log(self, pack, basicInfo, cellInfo):
+        if self.writer is None: return
+        if self.logger:
+            self.logger.log(basicInfo, cellInfo, pack)
+            return
+        logger = self.loggers.get(pack)
+        if logger is None:
+            logger = self.loggers[pack] = Logger(self.streamFn(self.fn, pack), self.writer,
+                                                 **dict(self.kwargs, pack = pack))
+        logger.log(basicInfo, cellInfo)
+
+    @property
+    def dropped(self):
+        return sum(l.dropped for l in [*self.loggers.values(), self.logger] if l)
+
+    def close(self):
+        if self.writer is None: return
+        for logger in [*self.loggers.values(), self.logger]:
+            if logger: logger.close()
+        if self.ownWriter:
+            self.writer.stop()
+        self.writer = None
 
 class DbgLock(object):
     def __init__(self):
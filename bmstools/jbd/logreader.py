@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+
+# BMS Tools
+# Copyright (C) 2020 Eric Poulsen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Time range queries over Logger output.
+#
+#   r = LogReader('pack.csv')
+#   cols = r.query(t0, t1, ['cell3_mv', 'pack_ma'])
+#
+# Handles .csv (vendor compatible or raw numeric), .jbl, their gzipped
+# segments, segmented logs (via <name>.index.csv) and SQLite logs; other
+# files, .xlsx included, are refused with a ValueError.  Columns use the
+# readBasicInfo() / readCellInfo() names plus 't' (epoch seconds).
+#
+# Segments outside the range are skipped using the segment index.  Within
+# a plain CSV file, a sparse time index (every indexStride rows, kept in a
+# <file>.tidx side file and extended as the file grows) gives the byte
+# offset to start reading at.  Binary logs are bisected on block start
+# times and need no side file.
+
+import os
+import re
+import time
+import array
+import struct
+import bisect
+
+from .binlog import BinLogReader
+from . import sqlitelog
+from .logging import Logger
+from .registers import BasicInfoReg
+from .optional import numpy as _numpy
+
+__all__ = ['LogReader']
+
+_tidxHeader = struct.Struct('<QQI') # bytes indexed, rows indexed, stride
+_tidxEntry = struct.Struct('<dQ')  # time, byte offset of the row
+
+_number = re.compile(r'-?[0-9.]+')
+
+def _num(scale = 1):
+    def parse(x):
+        v = float(_number.match(x).group()) * scale
+        return round(v) if scale != 1 else v
+    return parse
+
+def _onOff(x):
+    return 1 if x.strip() == 'ON' else 0
+
+def _hex(x):
+    return int(x, 16)
+
+def _compatColumn(name):
+    'canonical (name, parser) for a vendor compatible CSV header, or None'
+    m = re.fullmatch(r'Cell(\d+)', name)
+    if m: return f'cell{int(m.group(1)) - 1}_mv', _num(1000)
+    m = re.fullmatch(r'temp(\d+)', name)
+    if m: return f'ntc{int(m.group(1)) - 1}', float
+    return {
+        'PackVoltage': ('pack_mv', _num(1000)),
+        'current': ('pack_ma', _num(1000)),
+        'Average Vol': ('cell_avg_mv', _num(1000)),
+        'MaxCell': ('cell_max_mv', _num(1000)),
+        'MinCell': ('cell_min_mv', _num(1000)),
+        'RSOC': ('cap_pct', _num()),
+        'Remain cap': ('cur_cap', _num()),
+        'Full Charge Cap': ('full_cap', _num()),
+        'Cycle Count': ('cycle_cnt', _num()),
+        'CHG Fet Status': ('chg_fet_en', _onOff),
+        'DSG Fet Status': ('dsg_fet_en', _onOff),
+        'ProtectStatus': ('fault_raw', _hex),
+        'BalanceStatus': ('bal_raw', _hex),
+    }.get(name)
+
+class _CsvLog:
+    'one CSV file or gzipped CSV segment'
+    indexStride = 256
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.gz = fn.lower().endswith('.gz')
+        with self._open() as f:
+            header = f.readline().decode().rstrip('\r\n').split(',')
+        self.raw = 't' in header
+        self.columns = {} # name: (column number, parser)
+        for i, h in enumerate(header):
+            if self.raw:
+                if h in ('t', 'pack'): self.columns[h] = i, (float if h == 't' else str)
+                else: self.columns[h] = i, float
+            else:
+                c = _compatColumn(h)
+                if c: self.columns[c[0]] = i, c[1]
+        self.dateCol = None if self.raw else (header.index('Date'), header.index('time'))
+        self._dates = {}
+
+    def _open(self):
+        if self.gz:
+            import gzip
+            return gzip.open(self.fn, 'rb')
+        return open(self.fn, 'rb')
+
+    def rowTime(self, fields):
+        if self.raw:
+            return float(fields[self.columns['t'][0]])
+        date, tod = fields[self.dateCol[0]], fields[self.dateCol[1]]
+        ymd = self._dates.get(date)
+        if ymd is None:
+            ymd = self._dates[date] = tuple(int(i) for i in date.split('-'))
+        h, m, s = (int(i) for i in tod.split(':'))
+        return time.mktime((*ymd, h, m, s, 0, 0, -1))
+
+    def _index(self):
+        '''return the sparse [(t, offset), ...] index, building or extending
+        the .tidx side file as needed'''
+        tidx = self.fn + '.tidx'
+        size = os.path.getsize(self.fn)
+        done = rows = 0
+        entries = []
+        try:
+            with open(tidx, 'rb') as f:
+                done, rows, stride = _tidxHeader.unpack(f.read(_tidxHeader.size))
+                data = f.read()
+            if stride == self.indexStride and done <= size:
+                entries = [e for e in _tidxEntry.iter_unpack(data[:len(data) // _tidxEntry.size * _tidxEntry.size])]
+            else:
+                done = rows = 0
+        except (OSError, struct.error):
+            done = rows = 0
+        if done == size:
+            return entries
+
+        with open(self.fn, 'rb') as f:
+            if done:
+                f.seek(done)
+            else:
+                f.readline() # header
+            while True:
+                off = f.tell()
+                line = f.readline()
+                if not line.endswith(b'\n'): break # end of file, or a row still being written
+                if not rows % self.indexStride:
+                    try:
+                        entries.append((self.rowTime(line.decode().split(',')), off))
+                    except (ValueError, IndexError):
+                        continue # repeated header or damaged row; index the next one
+                rows += 1
+                done = f.tell()
+        try:
+            with open(tidx, 'wb') as f:
+                f.write(_tidxHeader.pack(done, rows, self.indexStride))
+                for e in entries:
+                    f.write(_tidxEntry.pack(*e))
+        except OSError:
+            pass # read only location; the index is rebuilt next time
+        return entries
+
+    def rows(self, start, end):
+        'yield (t, fields) for rows with start <= t < end'
+        offset = None
+        if not self.gz and start is not None:
+            entries = self._index()
+            i = bisect.bisect_right([e[0] for e in entries], start) - 1
+            if i >= 0: offset = entries[i][1]
+        with self._open() as f:
+            if offset is None:
+                f.readline()
+            else:
+                f.seek(offset)
+            for line in f:
+                fields = line.decode().rstrip('\r\n').split(',')
+                try:
+                    t = self.rowTime(fields)
+                except (ValueError, IndexError):
+                    continue # repeated header or damaged row
+                if start is not None and t < start: continue
+                if end is not None and t >= end: break
+                yield t, fields
+
+    def _times(self, offset = None):
+        'yield row times from offset (a row start), or from the first row'
+        with self._open() as f:
+            if offset is None:
+                f.readline()
+            else:
+                f.seek(offset)
+            for line in f:
+                try:
+                    yield self.rowTime(line.decode().rstrip('\r\n').split(','))
+                except (ValueError, IndexError):
+                    continue # repeated header or damaged row
+
+    def span(self):
+        '''return the (first, last) row time, or (None, None); the last is
+        read from the last time index entry on, not the whole file'''
+        first = next(self._times(), None)
+        if first is None: return None, None
+        if self.gz:
+            last = first
+            for last in self._times(): pass
+            return first, last
+        entries = self._index()
+        last = first
+        for last in self._times(entries[-1][1] if entries else None): pass
+        return first, last
+
+    def records(self, start, end, pack):
+        'yield (t, {column: value}) for rows with start <= t < end; empty cells are left out'
+        columns = [(n, i, parse) for n, (i, parse) in self.columns.items() if n not in ('t', 'pack')]
+        packCol = self.columns.get('pack', (None,))[0]
+        for t, fields in self.rows(start, end):
+            if pack is not None and packCol is not None and fields[packCol] != str(pack):
+                continue
+            values = {n: parse(fields[i]) for n, i, parse in columns if i < len(fields) and fields[i] != ''}
+            if packCol is not None:
+                values['pack'] = fields[packCol]
+            yield t, values
+
+    def query(self, start, end, names, pack):
+        cols = {n: [] for n in names}
+        parsers = []
+        for n in names:
+            if n == 't':
+                parsers.append((cols[n], None, None))
+            elif n in self.columns:
+                parsers.append((cols[n], *self.columns[n]))
+            else:
+                raise KeyError(f'{self.fn}: no column {n}')
+        packCol = self.columns.get('pack', (None,))[0]
+        for t, fields in self.rows(start, end):
+            if pack is not None and packCol is not None and fields[packCol] != str(pack):
+                continue
+            for col, i, parse in parsers:
+                if i is None:
+                    col.append(t)
+                else:
+                    v = fields[i]
+                    col.append(parse(v) if v != '' else float('nan'))
+        return cols
+
+class LogReader:
+    'time range and column queries over a log written by Logger; see the module comment'
+    def __init__(self, fn):
+        self.fn = fn
+        if not fn.lower().endswith(self.extensions):
+            raise ValueError(f'{fn}: LogReader reads {", ".join(self.extensions)} logs, not {os.path.splitext(fn)[1] or "this file"}')
+        self.files = self._files() # [(fn, start, end), ...]; start/end None if unknown
+
+    extensions = ('.csv', '.jbl', '.csv.gz', '.jbl.gz', '.sqlite', '.sqlite3', '.db')
+
+    def _files(self):
+        if self._isSqlite(self.fn):
+            return [(self.fn, None, None)]
+        segments = Logger.readIndex(self.fn)
+        d = os.path.dirname(self.fn)
+        base, ext = os.path.splitext(os.path.basename(self.fn))
+        indexed = {seg['segment'] for seg in segments}
+        pat = re.compile(re.escape(base) + r'\.(\d+)' + re.escape(ext) + r'(\.gz)?$')
+        found = {}
+        for name in os.listdir(d or '.'):
+            m = pat.match(name)
+            if m:
+                found.setdefault(name[:-3] if m.group(2) else name, name)
+        files = []
+        for seg in segments:
+            name = found.get(seg['segment'])
+            if name: # else expired
+                files.append((os.path.join(d, name), seg['start'], seg['end']))
+        # segments still being written, not yet in the index
+        for seg in sorted(set(found) - indexed):
+            files.append((os.path.join(d, found[seg]), None, None))
+        if not files and os.path.exists(self.fn):
+            files.append((self.fn, None, None))
+        return files
+
+    @staticmethod
+    def _isSqlite(fn):
+        return fn.lower().endswith(('.sqlite', '.sqlite3', '.db'))
+
+    def _queryFile(self, fn, start, end, columns, pack):
+        base = fn[:-3] if fn.lower().endswith('.gz') else fn
+        if self._isSqlite(base):
+            import sqlite3
+            db = sqlite3.connect(f'file:{fn}?mode=ro', uri = True)
+            try:
+                cols = sqlitelog.query(db, start, end, columns, pack)
+            finally:
+                db.close()
+            return {n: [float('nan') if v is None else v for v in c] if n != 'pack' else c
+                    for n, c in cols.items()}
+        if base.lower().endswith('.jbl'):
+            with BinLogReader(fn) as r:
+                return r.columns(*columns, start = start, end = end)
+        return _CsvLog(fn).query(start, end, columns, pack)
+
+    def query(self, start = None, end = None, columns = ('t',), pack = None):
+        '''return {column: array} for samples with start <= t < end (epoch
+        seconds).  pack selects one pack from a log with a pack column.
+        Arrays are NumPy arrays if NumPy is installed, else array.array.'''
+        columns = list(columns)
+        parts = {n: [] for n in columns}
+        for fn, fStart, fEnd in self.files:
+            if start is not None and fEnd is not None and fEnd < start: continue
+            if end is not None and fStart is not None and fStart >= end: continue
+            cols = self._queryFile(fn, start, end, columns, pack)
+            for n in columns:
+                parts[n].append(cols[n])
+
+        np = _numpy()
+        ret = {}
+        for n, p in parts.items():
+            if np is not None:
+                ret[n] = np.concatenate([np.asarray(i) for i in p]) if p else np.zeros(0)
+            else:
+                a = array.array('d')
+                for i in p: a.extend(float(v) for v in i)
+                ret[n] = a
+        return ret
+
+    def samples(self, start = None, end = None, pack = None):
+        '''yield (t, basicInfo, cellInfo, pack) with start <= t < end, with
+        dicts shaped like readBasicInfo() / readCellInfo(); values a log
+        doesn't keep are rebuilt or defaulted by BasicInfoReg.expand()'''
+        for fn, fStart, fEnd in self.files:
+            if start is not None and fEnd is not None and fEnd < start: continue
+            if end is not None and fStart is not None and fStart >= end: continue
+            base = fn[:-3] if fn.lower().endswith('.gz') else fn
+            if self._isSqlite(base):
+                import sqlite3
+                db = sqlite3.connect(f'file:{fn}?mode=ro', uri = True)
+                try:
+                    yield from sqlitelog.samples(db, start, end, pack)
+                finally:
+                    db.close()
+            elif base.lower().endswith('.jbl'):
+                with BinLogReader(fn) as r:
+                    for t, b, c in r.samples(start, end):
+                        yield t, b, c, None
+            else:
+                for t, values in _CsvLog(fn).records(start, end, pack):
+                    cells = sorted((int(n[4:-3]), v) for n, v in values.items()
+                                   if n.startswith('cell') and n[4:-3].isdigit())
+                    cellInfo = {f'cell{i}_mv': int(v) for i, v in cells}
+                    values = {n: int(v) if isinstance(v, float) and n.endswith(('_mv', '_ma', '_cap', '_cnt', '_pct', '_raw', '_en')) else v
+                              for n, v in values.items()}
+                    basicInfo = BasicInfoReg.expand(values)
+                    basicInfo['cell_cnt'] = len(cellInfo)
+                    yield t, basicInfo, cellInfo, values.get('pack')
+
+    def span(self):
+        'return the (first, last) sample time, or (None, None) for an empty log'
+        times = []
+        for fn, fStart, fEnd in self.files:
+            if fStart is not None:
+                times += [fStart, fEnd]
+            elif self._isSqlite(fn):
+                import sqlite3
+                db = sqlite3.connect(f'file:{fn}?mode=ro', uri = True)
+                try:
+                    times += [t for t in db.execute('SELECT min(ts), max(ts) FROM samples').fetchone()
+                              if t is not None]
+                finally:
+                    db.close()
+            elif fn.lower().endswith(('.jbl', '.jbl.gz')):
+                t = self._queryFile(fn, None, None, ['t'], None)['t']
+                if len(t):
+                    times += [float(t[0]), float(t[-1])]
+            else:
+                times += [t for t in _CsvLog(fn).span() if t is not None]
+        return (min(times), max(times)) if times else (None, None)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}: {self.fn}, {len(self.files)} files>'
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+# BMS Tools
+# Copyright (C) 2020 Eric Poulsen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Optional dependencies, imported on first use rather than at import time
+# (make check verifies nothing here is loaded by 'import bmstools').
+
+__all__ = ['numpy']
+
+def numpy(purpose = None):
+    '''return the numpy module, or None if it isn't installed.  With
+    purpose, a missing numpy raises ImportError naming what needed it.'''
+    try:
+        import numpy
+    except ImportError:
+        if purpose:
+            raise ImportError(f'{purpose} requires numpy (pip install numpy)') from None
+        return None
+    return numpy
@@ -29,6 +29,17 @@ import struct
 
 class BaseParser: pass
 
+class ByteTableMixin:
+    'adds decodeMany(), a bulk decode of raw byte values through a 256 entry table'
+    @classmethod
+    def decodeMany(cls, values):
+        'values is any iterable of ints 0-255, e.g. bytes; returns a list of decode() results'
+        table = cls.__dict__.get('_decodeTable')
+        if table is None:
+            table = tuple(cls.decode(i) for i in range(256))
+            cls._decodeTable = table
+        return list(map(table.__getitem__, values))
+
 def SafeFloat(v):
     try:
         return float(v)
@@ -64,7 +75,7 @@ class IntParserX10(IntParserX1):
 class IntParserD10(IntParserX1):
     factor = .1
 
-class ScParser(BaseParser):
+class ScParser(ByteTableMixin, BaseParser):
     @staticmethod
     def decode(string):
         i = int(string)
@@ -81,7 +92,7 @@ class ScParser(BaseParser):
         i |= (0x80 if sc_dsgoc_x2 else 0)
         return i
 
-class Dsgoc2Parser(BaseParser):
+class Dsgoc2Parser(ByteTableMixin, BaseParser):
     @staticmethod
     def decode(string):
         i = int(string)
@@ -109,7 +120,7 @@ class BitfieldParser(BaseParser):
             r |= (1<<i) if value else 0
         return r
 
-class CxvpDelayParser(BaseParser):
+class CxvpDelayParser(ByteTableMixin, BaseParser):
     @staticmethod
     def decode(value):
         i = int(value)
@@ -20,6 +20,10 @@ from .parsers import *
 from .enums import *
 import struct
 
+# precompiled structs shared by the register classes
+_U16 = struct.Struct('>H')
+_2B = struct.Struct('>2B')
+
 class BaseReg:
     'register base class; mostly exists for documenting methods and properties'
 
@@ -81,6 +85,7 @@ class BaseReg:
         return self._toDict().items()
 
 class ReadOnlyException(RuntimeError): pass
+class RangeError(ValueError): pass
 class ReadOnlyMixin:
     def set(self, valueName, value):
         raise ReadOnlyException(f'{self._regName} is read-only')
@@ -101,6 +106,7 @@ class IntReg(BaseReg):
             self.format = '>H'
         else:
             self.format = '>h'
+        self._struct = struct.Struct(self.format)
 
     @property
     def valueNames(self):
@@ -123,44 +129,46 @@ class IntReg(BaseReg):
         value = value or 0
         try:
             value = float(value)
-            if value < self.range[0] or value > self.range[1]:
-                raise ValueError(f'value {repr(value)} is outside of range {self.range}')
         except Exception as e:
             raise ValueError(f'value {repr(value)} is not valid for {self.__class__.__name__}')
+        if value < self.range[0] or value > self.range[1]:
+            raise RangeError(f'value {repr(value)} is outside of range {self.range}')
         self._value = value
 
     def unpack(self, payload):
-        self._value = struct.unpack(self.format, payload)[0] * self._factor
+        self._value = self._struct.unpack(payload)[0] * self._factor
 
     def pack(self):
-        return struct.pack(self.format, int(self._value // self._factor))
+        return self._struct.pack(int(self._value // self._factor))
 
     def __str__(self):
         return f'{self._regName}: {self._value}'
 
 class TempReg(IntReg):
-    'actual temperatures on device are stored as Kelvin * 10'
-    def __init__(self, valueName, adx):
+    '''actual temperatures on device are stored as Kelvin * 10; range is in
+    degrees C'''
+    def __init__(self, valueName, adx, range = (-273.15, 6136.4)): # maps to 0 --> 65535
         super().__init__(valueName, adx, Unit.C, 0)
+        self.range = tuple(range)
 
     def set(self, valueName, value):
         if not valueName == self._regName:
             raise KeyError(f'unknown value name {valuename}')
         try:
             value = float(value)
-            if not -273.15 <= value <= 6136.4: # maps to 0 --> 65535
-                raise ValueError(f'value {repr(value)} is outside of range(-32768, 327670)')
         except:
             raise ValueError(f'value {repr(value)} is not valid for {self.__class__.__name__}')
+        if not self.range[0] <= value <= self.range[1]:
+            raise RangeError(f'value {repr(value)} is outside of range {self.range}')
         self._value = value
     
     def unpack(self, payload):
-        value = struct.unpack('>H', payload)[0]
+        value = _U16.unpack(payload)[0]
         self._value = TempParser.decode(value)[0]
 
     def pack(self):
         value = TempParser.encode((self._value,))
-        return struct.pack('>H', value)
+        return _U16.pack(value)
 
 class TempRegRO(TempReg, ReadOnlyMixin): pass
 
@@ -224,11 +232,11 @@ class DelayReg(BaseReg):
         return list(self._values.keys())
 
     def unpack(self, payload):
-        values = struct.unpack('>2B', payload)
+        values = _2B.unpack(payload)
         self._values = dict(zip(self._values.keys(), values))
 
     def pack(self):
-        return struct.pack('>2B', *self._values.values())
+        return _2B.pack(*self._values.values())
 
 
 class BitfieldReg(BaseReg):
@@ -251,7 +259,7 @@ class BitfieldReg(BaseReg):
         self._values[valueName] = bool(value)
 
     def unpack(self, payload):
-        values = BitfieldParser.decode(struct.unpack('>H', payload)[0])
+        values = BitfieldParser.decode(_U16.unpack(payload)[0])
         values = values[:len(self.valueNames)]
 
         for k,v in zip(self._values.keys(), values):
@@ -259,7 +267,7 @@ class BitfieldReg(BaseReg):
 
     def pack(self):
         value = BitfieldParser.encode(self._values.values())
-        return struct.pack('>H', value)
+        return _U16.pack(value)
 
 class StringReg(BaseReg):
     def __init__(self, regName, adx, maxLen = 31):
@@ -329,11 +337,11 @@ class DateReg(BaseReg):
         return f'{self._year}-{self._month}-{self._day}'
 
     def unpack(self, payload):
-        value = struct.unpack('>H', payload)[0]
+        value = _U16.unpack(payload)[0]
         self._year, self._month, self._day = DateParser.decode(value)
     
     def pack(self):
-        return struct.pack('>H', DateParser.encode((self._year, self._month, self._day)))
+        return _U16.pack(DateParser.encode((self._year, self._month, self._day)))
 
 class ScDsgoc2Reg(BaseReg):
     _valueNames = ('sc', 'sc_delay', 'dsgoc2', 'dsgoc2_delay', 'sc_dsgoc_x2')
@@ -374,7 +382,7 @@ class ScDsgoc2Reg(BaseReg):
             raise KeyError(valueName)
 
     def unpack(self, payload):
-        b1, b2 = struct.unpack('>BB', payload)
+        b1, b2 = _2B.unpack(payload)
 
         self._sc, self._sc_delay, self._sc_dsgoc_x2 = ScParser.decode(b1)
         self._dsgoc2, self._dsgoc2_delay = Dsgoc2Parser.decode(b2)
@@ -382,7 +390,7 @@ class ScDsgoc2Reg(BaseReg):
     def pack(self):
         b1 = ScParser.encode((self._sc, self._sc_delay, self._sc_dsgoc_x2))
         b2 = Dsgoc2Parser.encode((self._dsgoc2, self._dsgoc2_delay))
-        return struct.pack('>BB', b1, b2)
+        return _2B.pack(b1, b2)
 
 
 class CxvpHighDelayScRelReg(BaseReg):
@@ -419,12 +427,12 @@ class CxvpHighDelayScRelReg(BaseReg):
             raise KeyError(valueName)
 
     def unpack(self, payload):
-        b1, self._sc_rel= struct.unpack('>BB', payload)
+        b1, self._sc_rel= _2B.unpack(payload)
         self._covp_high_delay, self._cuvp_high_delay = CxvpDelayParser.decode(b1)
     
     def pack(self):
         b1 = CxvpDelayParser.encode((self._cuvp_high_delay, self._covp_high_delay))
-        return struct.pack('>BB', b1, self._sc_rel)
+        return _2B.pack(b1, self._sc_rel)
 
 class BasicInfoReg(BaseReg):
     _balBits = [f'bal{i}' for i in range(32)]
@@ -447,6 +455,9 @@ class BasicInfoReg(BaseReg):
         'bal_raw'
     ]
 
+    _struct1 = struct.Struct('>HhHHHH')
+    _struct2 = struct.Struct('>HHHBBBBB')
+
     def __init__(self, regName, adx):
         self._regName = regName
         self._adx = adx
@@ -456,6 +467,29 @@ class BasicInfoReg(BaseReg):
             raise KeyError(valueName)
         return getattr(self, '_'+valueName)
 
+    @classmethod
+    def expand(cls, values):
+        '''return a readBasicInfo() style dict from the plain values a log
+        keeps: the bal/fault/FET bits are rebuilt from bal_raw, fault_raw,
+        chg_fet_en and dsg_fet_en, absent NTCs are None, and a missing
+        date or version reads as 2000-0-0 / 0'''
+        ret = dict.fromkeys(cls._valueNames)
+        ret.update((k, v) for k, v in values.items() if k in ret)
+        if ret['year'] is None:
+            ret['year'], ret['month'], ret['day'] = DateParser.decode(0)
+        if ret['version'] is None: ret['version'] = 0
+        ret['bal_raw'] = int(ret['bal_raw'] or 0)
+        ret['fault_raw'] = int(ret['fault_raw'] or 0)
+        for fn, value in cls._unpackBits(cls._balBits, ret['bal_raw']):
+            ret[fn[1:]] = value
+        for fn, value in cls._unpackBits(cls._faultBits, ret['fault_raw']):
+            ret[fn[1:]] = value
+        for fn in cls._fetBits:
+            ret[fn] = bool(ret[fn])
+        if ret['ntc_cnt'] is None:
+            ret['ntc_cnt'] = sum(ret[n] is not None for n in cls._ntcFields)
+        return ret
+
     @staticmethod
     def _unpackBits(fields, value):
         ret = []
@@ -465,18 +499,16 @@ class BasicInfoReg(BaseReg):
 
     def unpack(self, payload):
         offset = 0
-        fmt = '>HhHHHH'
-        values = struct.unpack_from(fmt, payload, offset)
+        values = self._struct1.unpack_from(payload, offset)
         self._pack_mv, self._pack_ma, self._cur_cap, self._full_cap, self._cycle_cnt, date_raw = values
         self._pack_mv *= 10
         self._pack_ma *= 10
         self._cur_cap *= 10
         self._full_cap *= 10
         self._year, self._month, self._day = DateParser.decode(date_raw)
-        offset += struct.calcsize(fmt)
+        offset += self._struct1.size
 
-        fmt = '>HHHBBBBB'
-        values = struct.unpack_from(fmt, payload, offset)
+        values = self._struct2.unpack_from(payload, offset)
         bal_raw0, bal_raw1, self._fault_raw, self._version, self._cap_pct, fet_raw, self._cell_cnt, self._ntc_cnt = values
         self._bal_raw = bal_raw0 | (bal_raw1 << 16)
         for fn, value in self._unpackBits(self._balBits, self._bal_raw):
@@ -485,13 +517,13 @@ class BasicInfoReg(BaseReg):
             setattr(self, fn, value)
         for fn, value in self._unpackBits(self._fetBits, fet_raw):
             setattr(self, fn, value)
-        offset += struct.calcsize(fmt)
+        offset += self._struct2.size
 
         for i in range(8):
             fn = f'_ntc{i}'
             if i < self._ntc_cnt:
                 o = offset + i *2
-                date_raw = struct.unpack_from('>H', payload,o)[0]
+                date_raw = _U16.unpack_from(payload,o)[0]
                 setattr(self, fn, TempParser.decode(date_raw)[0])
             else:
                 setattr(self, fn, None)
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+
+# BMS Tools
+# Copyright (C) 2020 Eric Poulsen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Declarative EEPROM register map.
+#
+# This table is the single place EEPROM registers are described.  JBD's
+# register list and lookup indexes, and JBDPersist's .fig field table are
+# all generated from it, so adding a register means adding one entry here.
+#
+# Entries are in .fig file order, which is the order the vendor app writes.
+#
+# range is the accepted value range, passed to the register: IntReg
+# takes it in register units (before its factor), TempReg in degrees C.
+# Registers without one accept anything that fits their encoding; .fig
+# files store int16, so full width registers (capacities, pack voltages,
+# serial number) keep IntReg's int16 default.
+
+from .registers import (Unit, IntReg, TempReg, DateReg, DelayReg,
+                        ScDsgoc2Reg, CxvpHighDelayScRelReg,
+                        BitfieldReg, StringReg, ErrorCountReg,
+                        ReadOnlyException, RangeError)
+from .parsers import *
+
+__all__ = ['RegDef', 'eepromRegMap', 'figFields', 'makeEepromRegs',
+           'indexRegs', 'validateData', 'checkRegNames']
+
+class RegDef:
+    'one EEPROM register: name, address, register class and args, and .fig fields'
+    __slots__ = 'regName', 'adx', 'cls', 'args', 'kwargs', 'range', 'fig'
+
+    def __init__(self, regName, adx, cls, *args, range = None, fig = (), **kwargs):
+        'fig is a tuple of (fig field name, value names, parser)'
+        self.regName = regName
+        self.adx = adx
+        self.cls = cls
+        self.args = args
+        self.kwargs = kwargs
+        self.range = range
+        self.fig = fig
+
+    def make(self):
+        'return a new register instance for this entry'
+        kwargs = self.kwargs
+        if self.range is not None:
+            kwargs = dict(kwargs, range = self.range)
+        return self.cls(self.regName, self.adx, *self.args, **kwargs)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}: {self.regName} 0x{self.adx:02X}>'
+
+# common ranges; see the module comment for units
+_cellMv = (0, 5000)
+_temp = (-50, 150)
+
+eepromRegMap = (
+    # Capacity Config
+    RegDef('design_cap', 0x10, IntReg, Unit.MAH, 10,
+        fig = (('DesignCapacity', ('design_cap',), IntParserX10),)),
+    RegDef('cycle_cap', 0x11, IntReg, Unit.MAH, 10,
+        fig = (('CycleCapacity', ('cycle_cap',), IntParserX10),)),
+    RegDef('cap_100', 0x12, IntReg, Unit.MV, 1, # AKA "Full Chg Vol"
+        range = _cellMv, fig = (('FullChargeVol', ('cap_100',), IntParserX1),)),
+    RegDef('cap_0', 0x13, IntReg, Unit.MV, 1, # AKA "End of Dsg VOL"
+        range = _cellMv, fig = (('ChargeEndVol', ('cap_0',), IntParserX1),)),
+    RegDef('dsg_rate', 0x14, IntReg, Unit.PCT, .1, # presuming this means rate of self-discharge
+        range = (0, 1000), fig = (('DischargingRate', ('dsg_rate',), IntParserD10),)),
+
+    # Other Configuration
+    RegDef('mfg_date', 0x15, DateReg,
+        fig = (('ManufactureDate', ('year', 'month', 'day'), DateParser),)),
+    RegDef('serial_num', 0x16, IntReg, int, 1,
+        fig = (('SerialNumber', ('serial_num',), IntParserX1),)),
+    RegDef('cycle_cnt', 0x17, IntReg, int, 1,
+        fig = (('CycleCount', ('cycle_cnt',), IntParserX1),)),
+
+    # Basic Parameters
+    RegDef('chgot', 0x18, TempReg,
+        range = _temp, fig = (('ChgOverTemp', ('chgot',), TempParser),)),
+    RegDef('chgot_rel', 0x19, TempReg,
+        range = _temp, fig = (('ChgOTRelease', ('chgot_rel',), TempParser),)),
+    RegDef('chgut', 0x1a, TempReg,
+        range = _temp, fig = (('ChgLowTemp', ('chgut',), TempParser),)),
+    RegDef('chgut_rel', 0x1b, TempReg,
+        range = _temp, fig = (('ChgUTRelease', ('chgut_rel',), TempParser),)),
+    RegDef('dsgot', 0x1c, TempReg,
+        range = _temp, fig = (('DisOverTemp', ('dsgot',), TempParser),)),
+    RegDef('dsgot_rel', 0x1d, TempReg,
+        range = _temp, fig = (('DsgOTRelease', ('dsgot_rel',), TempParser),)),
+    RegDef('dsgut', 0x1e, TempReg,
+        range = _temp, fig = (('DisLowTemp', ('dsgut',), TempParser),)),
+    RegDef('dsgut_rel', 0x1f, TempReg,
+        range = _temp, fig = (('DsgUTRelease', ('dsgut_rel',), TempParser),)),
+    RegDef('povp', 0x20, IntReg, Unit.MV, 10,
+        fig = (('PackOverVoltage', ('povp',), IntParserX10),)),
+    RegDef('povp_rel', 0x21, IntReg, Unit.MV, 10,
+        fig = (('PackOVRelease', ('povp_rel',), IntParserX10),)),
+    RegDef('puvp', 0x22, IntReg, Unit.MV, 10,
+        fig = (('PackUnderVoltage', ('puvp',), IntParserX10),)),
+    RegDef('puvp_rel', 0x23, IntReg, Unit.MV, 10,
+        fig = (('PackUVRelease', ('puvp_rel',), IntParserX10),)),
+    RegDef('covp', 0x24, IntReg, Unit.MV, 1,
+        range = _cellMv, fig = (('CellOverVoltage', ('covp',), IntParserX1),)),
+    RegDef('covp_rel', 0x25, IntReg, Unit.MV, 1,
+        range = _cellMv, fig = (('CellOVRelease', ('covp_rel',), IntParserX1),)),
+    RegDef('cuvp', 0x26, IntReg, Unit.MV, 1,
+        range = _cellMv, fig = (('CellUnderVoltage', ('cuvp',), IntParserX1),)),
+    RegDef('cuvp_rel', 0x27, IntReg, Unit.MV, 1,
+        range = _cellMv, fig = (('CellUVRelease', ('cuvp_rel',), IntParserX1),)),
+    RegDef('chgoc', 0x28, IntReg, Unit.MA, 10,
+        range = (0, 32767), fig = (('OverChargeCurrent', ('chgoc',), IntParserX10),)),
+    RegDef('dsgoc', 0x29, IntReg, Unit.MA, 10,
+        range = (-32768, 0), fig = (('OverDisCurrent', ('dsgoc',), IntParserX10),)),
+
+    # Balance Configuration
+    RegDef('bal_start', 0x2a, IntReg, Unit.MV, 1,
+        range = _cellMv, fig = (('BalanceStartVoltage', ('bal_start',), IntParserX1),)),
+    RegDef('bal_window', 0x2b, IntReg, Unit.MV, 1,
+        range = _cellMv, fig = (('BalanceWindow', ('bal_window',), IntParserX1),)),
+
+    # Other Configuration
+    RegDef('shunt_res', 0x2c, IntReg, Unit.MO, .1,
+        fig = (('SenseResistor', ('shunt_res',), IntParserD10),)),
+
+    # Function Configuration
+    RegDef('func_config', 0x2d, BitfieldReg,
+        'switch', 'scrl', 'balance_en', 'chg_balance_en', 'led_en', 'led_num',
+        fig = (('BatteryConfig', ('switch', 'scrl', 'balance_en', 'chg_balance_en', 'led_en', 'led_num'), BitfieldParser),)),
+
+    # NTC Configuration
+    RegDef('ntc_config', 0x2e, BitfieldReg, *(f'ntc{i+1}' for i in range(8)),
+        fig = (('NtcConfig', tuple(f'ntc{i+1}' for i in range(8)), BitfieldParser),)),
+
+    # Other Configuration
+    RegDef('cell_cnt', 0x2f, IntReg, int, 1,
+        range = (1, 32), fig = (('PackNum', ('cell_cnt',), IntParserX1),)),
+    RegDef('fet_ctrl', 0x30, IntReg, Unit.S, 1,
+        fig = (('fet_ctrl_time_set', ('fet_ctrl',), IntParserX1),)),
+    RegDef('led_timer', 0x31, IntReg, Unit.S, 1,
+        fig = (('led_disp_time_set', ('led_timer',), IntParserX1),)),
+
+    # Capacity Config
+    RegDef('cap_80', 0x32, IntReg, Unit.MV, 1,
+        range = _cellMv, fig = (('VoltageCap80', ('cap_80',), IntParserX1),)),
+    RegDef('cap_60', 0x33, IntReg, Unit.MV, 1,
+        range = _cellMv, fig = (('VoltageCap60', ('cap_60',), IntParserX1),)),
+    RegDef('cap_40', 0x34, IntReg, Unit.MV, 1,
+        range = _cellMv, fig = (('VoltageCap40', ('cap_40',), IntParserX1),)),
+    RegDef('cap_20', 0x35, IntReg, Unit.MV, 1,
+        range = _cellMv, fig = (('VoltageCap20', ('cap_20',), IntParserX1),)),
+
+    # High Protection Configuration
+    RegDef('covp_high', 0x36, IntReg, Unit.MV, 1,
+        range = (3110, 4635), fig = (('HardCellOverVoltage', ('covp_high',), IntParserX1),)),
+    RegDef('cuvp_high', 0x37, IntReg, Unit.MV, 1,
+        range = (1575, 3101), fig = (('HardCellUnderVoltage', ('cuvp_high',), IntParserX1),)),
+    RegDef('sc_dsgoc2', 0x38, ScDsgoc2Reg,
+        fig = (('HardChgOverCurrent', ('sc', 'sc_delay', 'sc_dsgoc_x2'), ScParser),
+               ('HardDsgOverCurrent', ('dsgoc2', 'dsgoc2_delay'), Dsgoc2Parser))),
+    RegDef('cxvp_high_delay_sc_rel', 0x39, CxvpHighDelayScRelReg,
+        fig = (('HardTime', ('covp_high_delay', 'cuvp_high_delay'), CxvpDelayParser),
+               ('SCReleaseTime', ('sc_rel',), IntParserX1))),
+
+    # Basic Parameters (delays)
+    RegDef('chg_t_delays', 0x3a, DelayReg, 'chgut_delay', 'chgot_delay',
+        fig = (('ChgUTDelay', ('chgut_delay',), IntParserX1),
+               ('ChgOTDelay', ('chgot_delay',), IntParserX1))),
+    RegDef('dsg_t_delays', 0x3b, DelayReg, 'dsgut_delay', 'dsgot_delay',
+        fig = (('DsgUTDelay', ('dsgut_delay',), IntParserX1),
+               ('DsgOTDelay', ('dsgot_delay',), IntParserX1))),
+    RegDef('pack_v_delays', 0x3c, DelayReg, 'puvp_delay', 'povp_delay',
+        fig = (('PackUVDelay', ('puvp_delay',), IntParserX1),
+               ('PackOVDelay', ('povp_delay',), IntParserX1))),
+    RegDef('cell_v_delays', 0x3d, DelayReg, 'cuvp_delay', 'covp_delay',
+        fig = (('CellUVDelay', ('cuvp_delay',), IntParserX1),
+               ('CellOVDelay', ('covp_delay',), IntParserX1))),
+    RegDef('chgoc_delays', 0x3e, DelayReg, 'chgoc_delay', 'chgoc_rel',
+        fig = (('ChgOCDelay', ('chgoc_delay',), IntParserX1),
+               ('ChgOCRDelay', ('chgoc_rel',), IntParserX1))),
+    RegDef('dsgoc_delays', 0x3f, DelayReg, 'dsgoc_delay', 'dsgoc_rel',
+        fig = (('DsgOCDelay', ('dsgoc_delay',), IntParserX1),
+               ('DsgOCRDelay', ('dsgoc_rel',), IntParserX1))),
+
+    # Other Configuration
+    RegDef('mfg_name', 0xa0, StringReg, fig = (('ManufacturerName', ('mfg_name',), StrParser),)),
+    RegDef('device_name', 0xa1, StringReg, fig = (('DeviceName', ('device_name',), StrParser),)),
+    RegDef('barcode', 0xa2, StringReg, fig = (('BarCode', ('barcode',), StrParser),)),
+
+    # Errors
+    RegDef('error_cnts', 0xaa, ErrorCountReg),
+)
+
+# .fig field name --> (value names, parser), in file order
+figFields = {name: (valueNames, parser)
+             for regDef in eepromRegMap
+             for name, valueNames, parser in regDef.fig}
+
+def makeEepromRegs():
+    'return a fresh list of register instances, one per map entry'
+    return [regDef.make() for regDef in eepromRegMap]
+
+def indexRegs(regs):
+    'return (by value name, by address, by register name) lookup dicts for regs'
+    byValueName = {}
+    byAdx = {}
+    byRegName = {}
+    for reg in regs:
+        byValueName.update({k:reg for k in reg.valueNames})
+        byAdx[reg.adx] = reg
+        byRegName[reg.regName] = reg
+    return byValueName, byAdx, byRegName
+
+# prototype instances; used to build the map-level indexes below
+_protoRegs = makeEepromRegs()
+
+# map-level indexes of RegDef entries
+regDefByAdx = {d.adx: d for d in eepromRegMap}
+regDefByRegName = {d.regName: d for d in eepromRegMap}
+regDefByValueName = {n: d for d, r in zip(eepromRegMap, _protoRegs) for n in r.valueNames}
+
+def validateData(data, regs = None):
+    '''check each value in a {valueName: value} dict against its register's
+    range; returns a list of error strings.  regs is an optional list of
+    register instances to (re)use.'''
+    byValueName = indexRegs(regs or makeEepromRegs())[0]
+    errors = []
+    for valueName, value in data.items():
+        reg = byValueName.get(valueName)
+        if reg is None:
+            errors.append(f'unknown value {valueName}')
+            continue
+        try:
+            reg.set(valueName, value)
+        except ReadOnlyException:
+            pass
+        except RangeError:
+            errors.append(f'{valueName}: {value!r} is outside of range {reg.range}')
+        except (ValueError, KeyError, TypeError):
+            errors.append(f'{valueName}: invalid value {value!r}')
+    return errors
+
+def checkRegNames():
+    'sanity check for the register map; returns a list of error strings'
+    errors = []
+    regNames = {}
+    adxs = {}
+    valueNamesToRegs = {}
+    figNames = {}
+
+    for regDef, reg in zip(eepromRegMap, _protoRegs):
+        if regDef.regName in regNames:
+            errors.append(f'register name {regDef.regName} occurs more than once')
+        regNames[regDef.regName] = regDef
+
+        if regDef.adx in adxs:
+            errors.append(f'address 0x{regDef.adx:02X} used by {regDef.regName} and {adxs[regDef.adx].regName}')
+        adxs[regDef.adx] = regDef
+
+        for n in reg.valueNames:
+            if n in valueNamesToRegs:
+                otherReg = valueNamesToRegs[n]
+                errors.append(f'duplicate value name "{n}" in regs {reg.regName} and {otherReg.regName}')
+            else:
+                valueNamesToRegs[n] = reg
+
+        for figName, valueNames, parser in regDef.fig:
+            if figName in figNames:
+                errors.append(f'duplicate .fig field "{figName}" in regs {regDef.regName} and {figNames[figName].regName}')
+            figNames[figName] = regDef
+            for n in valueNames:
+                if n not in reg.valueNames:
+                    errors.append(f'.fig field "{figName}" value "{n}" is not in reg {regDef.regName}')
+    return errors
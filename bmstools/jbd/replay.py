@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+# BMS Tools
+# Copyright (C) 2020 Eric Poulsen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Replay of recorded logs (.csv, .jbl, .sqlite, segmented logs) and raw
+# frame captures (.jbc), as (basicInfo, cellInfo, deviceInfo) samples
+# shaped like JBD.readInfo() returns them.
+#
+#   r = Replayer('night.jbl', speed = 10)
+#   r.run(lambda t, basicInfo, cellInfo, deviceInfo: ...)
+#
+# speed 1 is real time, 10 is ten times faster, 0 as fast as possible.
+# speed and seek() can be changed from another thread while run() is
+# going, as can stop().
+#
+#   python -m bmstools.jbd.replay night.jbl -s 0
+
+import os
+import time
+import threading
+
+from .capture import CaptureReader
+from .logreader import LogReader
+
+__all__ = ['Replayer']
+
+class Replayer:
+    def __init__(self, fn, speed = 1, pack = None):
+        self.fn = fn
+        self.pack = pack
+        self.speed = speed
+        self.position = None # log time of the last sample played
+        self.capture = fn.lower().endswith('.jbc')
+        self._seek = None
+        self._running = False
+        self._lock = threading.Lock()
+        self.deviceInfo = {'device_name': f'replay: {os.path.basename(fn)}'}
+        if self.capture:
+            with CaptureReader(fn) as r:
+                for frame in r.frames(0x05):
+                    if frame.decode():
+                        self.deviceInfo = frame.decode()
+                        break
+
+    def span(self):
+        'return the (first, last) sample time in the log'
+        if self.capture:
+            with CaptureReader(self.fn) as r:
+                times = [t for t, b, c in r.samples(self.pack)]
+            return (times[0], times[-1]) if times else (None, None)
+        return LogReader(self.fn).span()
+
+    def samples(self, start = None, end = None):
+        'yield (t, basicInfo, cellInfo) with start <= t < end, unpaced'
+        if self.capture:
+            with CaptureReader(self.fn) as r:
+                yield from r.samples(self.pack, start, end)
+        else:
+            for t, basicInfo, cellInfo, pack in LogReader(self.fn).samples(start, end, self.pack):
+                yield t, basicInfo, cellInfo
+
+    def seek(self, t):
+        'continue playback from log time t'
+        with self._lock:
+            self._seek = t
+
+    def stop(self):
+        self._running = False
+
+    def run(self, callback, start = None, end = None):
+        '''play samples with start <= t < end into callback(t, basicInfo,
+        cellInfo, deviceInfo), paced by speed; returns when the log ends or
+        stop() is called.  Returns the number of samples played.'''
+        self._running = True
+        self._seek = start
+        played = 0
+        while self._running:
+            with self._lock:
+                seek, self._seek = self._seek, None
+            samples = self.samples(seek, end)
+            anchor = None # (log time, wall time, speed) pacing is measured from
+            seeked = False
+            for t, basicInfo, cellInfo in samples:
+                speed = self.speed
+                if anchor is None or anchor[2] != speed:
+                    anchor = t, time.monotonic(), speed
+                if speed:
+                    due = anchor[1] + (t - anchor[0]) / speed
+                    while self._running and self._seek is None:
+                        delay = due - time.monotonic()
+                        if delay <= 0: break
+                        time.sleep(min(delay, .1))
+                        if self.speed != speed: break # re-anchor at the new speed
+                if not self._running: break
+                if self._seek is not None:
+                    seeked = True
+                    break
+                self.position = t
+                callback(t, basicInfo, cellInfo, self.deviceInfo)
+                played += 1
+            samples.close()
+            if not seeked: break
+        self._running = False
+        return played
+
+def main():
+    import argparse
+    p = argparse.ArgumentParser(description = 'replay a recorded log or frame capture')
+    p.add_argument('log', help = '.csv, .jbl, .sqlite or .jbc file')
+    p.add_argument('-s', '--speed', type = float, default = 0, help = 'playback speed, 0 for as fast as possible (default)')
+    p.add_argument('-p', '--pack', help = 'pack to replay from a multi-pack log')
+    args = p.parse_args()
+
+    def show(t, basicInfo, cellInfo, deviceInfo):
+        ts = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t))
+        print(ts, basicInfo['pack_mv'], basicInfo['pack_ma'], *cellInfo.values())
+
+    Replayer(args.log, args.speed, args.pack).run(show)
+
+if __name__ == '__main__':
+    main()
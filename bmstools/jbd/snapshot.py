@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+# BMS Tools
+# Copyright (C) 2020 Eric Poulsen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Content addressed EEPROM snapshot store, in a single SQLite file.
+#
+#   blobs        one row per distinct register payload, keyed by hash
+#   configs      one row per distinct config (set of register payloads)
+#   config_regs  the blob references that make up each config
+#   snapshots    device, time, config hash and the pack's own registers;
+#                indexed on (device, ts)
+#
+# A config is the writable registers less the per-pack ones drift ignores
+# (serial number, barcode, manufacturing date, cycle count).  Those, and
+# the read-only counters, are kept packed on the snapshot row, so
+# identically configured packs share one config.  A pack with the same
+# config as a thousand others costs one snapshots row, and lookups go
+# through indexes, so both stay flat as the fleet grows.
+
+import sqlite3
+import hashlib
+import time
+
+from .image import dataToImage, imageToData
+from .drift import imageHash, canonicalImage, defaultIgnore, _ignoredAdxs
+from .regmap import makeEepromRegs, regDefByValueName
+
+__all__ = ['SnapshotStore', 'deviceKey']
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS blobs (
+    hash BLOB PRIMARY KEY, adx INTEGER NOT NULL, payload BLOB NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS configs (
+    hash BLOB PRIMARY KEY) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS config_regs (
+    config BLOB NOT NULL, adx INTEGER NOT NULL, blob BLOB NOT NULL,
+    PRIMARY KEY (config, adx)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY, device TEXT NOT NULL, ts REAL NOT NULL, config BLOB NOT NULL,
+    regs BLOB);
+CREATE INDEX IF NOT EXISTS snapshots_device_ts ON snapshots (device, ts);
+'''
+
+def deviceKey(data):
+    'device key for a readEeprom() style dict: barcode if set, else serial number'
+    barcode = str(data.get('barcode') or '').strip()
+    if barcode:
+        return barcode
+    if data.get('serial_num') is None:
+        raise ValueError('snapshot has neither barcode nor serial_num; pass device explicitly')
+    return str(int(data['serial_num']))
+
+def _blobHash(adx, payload):
+    return hashlib.sha1(bytes((adx,)) + payload).digest()
+
+def _packRegs(image):
+    'pack an {adx: bytes} image as (adx u8, length u8, payload) records'
+    return b''.join(bytes((adx, len(payload))) + payload for adx, payload in sorted(image.items()))
+
+def _unpackRegs(data):
+    ret = {}
+    off = 0
+    while off + 2 <= len(data or b''):
+        adx, n = data[off], data[off + 1]
+        ret[adx] = bytes(data[off + 2:off + 2 + n])
+        off += 2 + n
+    return ret
+
+class SnapshotStore:
+    def __init__(self, fn):
+        self.fn = fn
+        self.db = sqlite3.connect(fn)
+        self.db.executescript(_schema)
+        if 'regs' not in [r[1] for r in self.db.execute('PRAGMA table_info(snapshots)')]:
+            self.db.execute('ALTER TABLE snapshots ADD COLUMN regs BLOB') # stores from before regs
+        self._regs = {reg.adx: reg for reg in makeEepromRegs()}
+        self._ignore = _ignoredAdxs(defaultIgnore)
+
+    def put(self, snapshot, device = None, ts = None):
+        '''store a snapshot, either a readEeprom() style value dict or an
+        {adx: bytes} image; returns the snapshot id.  device defaults to
+        deviceKey(snapshot) and ts to now.'''
+        isImage = all(isinstance(k, int) for k in snapshot.keys())
+        if device is None:
+            device = deviceKey(imageToData(snapshot) if isImage else snapshot)
+        image = snapshot if isImage else dataToImage(snapshot)
+        image = {adx: bytes(payload) for adx, payload in image.items()}
+        ts = time.time() if ts is None else ts
+        configImage = canonicalImage(image, self._ignore)
+        own = {adx: payload for adx, payload in image.items() if adx not in configImage}
+        config = imageHash(configImage)
+
+        with self.db:
+            cur = self.db.execute('INSERT OR IGNORE INTO configs VALUES (?)', (config,))
+            if cur.rowcount: # new config; store its registers
+                refs = [(adx, payload, _blobHash(adx, payload)) for adx, payload in configImage.items()]
+                self.db.executemany('INSERT OR IGNORE INTO blobs VALUES (?, ?, ?)',
+                                    [(h, adx, payload) for adx, payload, h in refs])
+                self.db.executemany('INSERT INTO config_regs VALUES (?, ?, ?)',
+                                    [(config, adx, h) for adx, payload, h in refs])
+            cur = self.db.execute('INSERT INTO snapshots (device, ts, config, regs) VALUES (?, ?, ?, ?)',
+                                  (str(device), ts, config, _packRegs(own)))
+        return cur.lastrowid
+
+    def devices(self):
+        return [r[0] for r in self.db.execute('SELECT DISTINCT device FROM snapshots ORDER BY device')]
+
+    def snapshots(self, device):
+        'return [(snapshot id, ts), ...] for device, oldest first'
+        return self.db.execute('SELECT id, ts FROM snapshots WHERE device = ? ORDER BY ts',
+                               (str(device),)).fetchall()
+
+    def image(self, snapshotId):
+        'return the {adx: bytes} image for a snapshot id: its config plus its own registers'
+        rows = self.db.execute('''
+            SELECT b.adx, b.payload FROM snapshots s
+            JOIN config_regs c ON c.config = s.config
+            JOIN blobs b ON b.hash = c.blob
+            WHERE s.id = ?''', (snapshotId,))
+        ret = {adx: payload for adx, payload in rows}
+        row = self.db.execute('SELECT regs FROM snapshots WHERE id = ?', (snapshotId,)).fetchone()
+        if row: ret.update(_unpackRegs(row[0]))
+        return ret
+
+    def latest(self, device, ts = None):
+        '''return (ts, image) of the latest snapshot of device, at or before
+        ts if given; None if there is none'''
+        if ts is None:
+            row = self.db.execute('SELECT id, ts FROM snapshots WHERE device = ? ORDER BY ts DESC LIMIT 1',
+                                  (str(device),)).fetchone()
+        else:
+            row = self.db.execute('SELECT id, ts FROM snapshots WHERE device = ? AND ts <= ? ORDER BY ts DESC LIMIT 1',
+                                  (str(device), ts)).fetchone()
+        if row is None:
+            return None
+        return row[1], self.image(row[0])
+
+    def latestData(self, device, ts = None):
+        'like latest(), but returns (ts, decoded value dict)'
+        r = self.latest(device, ts)
+        return r and (r[0], imageToData(r[1]))
+
+    def history(self, device, valueName):
+        '''return [(ts, value), ...] for one value across device's snapshots,
+        oldest first.  Only the value's register is read, and each distinct
+        payload is decoded once.'''
+        regDef = regDefByValueName.get(valueName)
+        if regDef is None:
+            raise KeyError(valueName)
+        adx = regDef.adx
+        reg = self._regs[adx]
+        rows = self.db.execute('''
+            SELECT s.ts, s.regs, b.payload FROM snapshots s
+            LEFT JOIN config_regs c ON c.config = s.config AND c.adx = ?
+            LEFT JOIN blobs b ON b.hash = c.blob
+            WHERE s.device = ? ORDER BY s.ts''', (adx, str(device)))
+        decoded = {}
+        ret = []
+        for ts, regs, payload in rows:
+            if payload is None: # a per-pack register, on the snapshot row
+                payload = _unpackRegs(regs).get(adx)
+                if payload is None: continue
+            payload = bytes(payload)
+            if payload not in decoded:
+                reg.unpack(payload)
+                decoded[payload] = reg.get(valueName)
+            ret.append((ts, decoded[payload]))
+        return ret
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+# BMS Tools
+# Copyright (C) 2020 Eric Poulsen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# SQLite log backend (.sqlite, .sqlite3, .db).
+#
+#   samples   one row per sample: pack, ts, mono (the monotonic clock ts
+#             was taken from) and the basic info values
+#   cells     (sample, cell, mv), one row per cell voltage
+#   events    fault, FET and balance transitions per pack
+#
+# samples and events are indexed on (pack, ts), so one file can hold a
+# site's whole fleet.  The database is in WAL mode and rows are inserted
+# inside a transaction that is committed on flush(), i.e. in batches by
+# the LogWriter thread.
+
+import sqlite3
+
+from .registers import BasicInfoReg
+
+__all__ = ['SqliteLog', 'sampleColumns', 'query', 'samples']
+
+sampleColumns = ('pack_mv', 'pack_ma', 'cur_cap', 'full_cap', 'cap_pct', 'cycle_cnt',
+                 'chg_fet_en', 'dsg_fet_en', 'fault_raw', 'bal_raw',
+                 *BasicInfoReg._ntcFields)
+
+_schema = f'''
+CREATE TABLE IF NOT EXISTS samples (
+    id INTEGER PRIMARY KEY, pack TEXT, ts REAL NOT NULL, mono REAL,
+    {', '.join(f'{n} {"REAL" if n.startswith("ntc") else "INTEGER"}' for n in sampleColumns)});
+CREATE INDEX IF NOT EXISTS samples_pack_ts ON samples (pack, ts);
+CREATE TABLE IF NOT EXISTS cells (
+    sample INTEGER NOT NULL, cell INTEGER NOT NULL, mv INTEGER,
+    PRIMARY KEY (sample, cell)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY, pack TEXT, ts REAL NOT NULL,
+    kind TEXT NOT NULL, raw INTEGER, detail TEXT);
+CREATE INDEX IF NOT EXISTS events_pack_ts ON events (pack, ts);
+'''
+
+_insertSample = f'INSERT INTO samples (pack, ts, mono, {", ".join(sampleColumns)}) VALUES ({", ".join("?" * (len(sampleColumns) + 3))})'
+
+def _bitNames(names, old, new):
+    changed = old ^ new
+    return ' '.join(('+' if new & (1 << bit) else '-') + name
+                    for bit, name in enumerate(names) if changed & (1 << bit))
+
+class SqliteLog:
+    '''file-like SQLite log: write(t, basicInfo, cellInfo, pack, mono) / flush() /
+    close().  Existing databases are appended to.'''
+    def __init__(self, fn, pack = None):
+        self.fn = fn
+        self.pack = pack
+        # created here, used only by the LogWriter thread from then on
+        self.db = sqlite3.connect(fn, check_same_thread = False, isolation_level = None)
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.executescript(_schema)
+        if 'mono' not in [r[1] for r in self.db.execute('PRAGMA table_info(samples)')]:
+            self.db.execute('ALTER TABLE samples ADD COLUMN mono REAL') # logs from before mono
+        self.inTransaction = False
+        self.last = {} # pack: (fault_raw, fet bits, bal_raw)
+
+    def write(self, t, basicInfo, cellInfo, pack = None, mono = None):
+        pack = self.pack if pack is None else pack
+        if not self.inTransaction:
+            self.db.execute('BEGIN')
+            self.inTransaction = True
+        b = basicInfo
+        cur = self.db.execute(_insertSample, (pack, t, mono, *[
+            int(b[n]) if isinstance(b.get(n), bool) else b.get(n) for n in sampleColumns]))
+        sample = cur.lastrowid
+        self.db.executemany('INSERT INTO cells VALUES (?, ?, ?)',
+                            [(sample, i, mv) for i, mv in enumerate(cellInfo.values())])
+        self._events(t, pack, b)
+
+    def _events(self, t, pack, b):
+        fet = bool(b['chg_fet_en']) | (bool(b['dsg_fet_en']) << 1)
+        state = b['fault_raw'], fet, b['bal_raw']
+        last = self.last.get(pack)
+        self.last[pack] = state
+        if last is None or last == state: return
+        events = []
+        if state[0] != last[0]:
+            events.append(('fault', state[0], _bitNames(BasicInfoReg._faultBits, last[0], state[0])))
+        if state[1] != last[1]:
+            events.append(('fet', state[1], _bitNames(BasicInfoReg._fetBits, last[1], state[1])))
+        if state[2] != last[2]:
+            events.append(('balance', state[2], _bitNames(BasicInfoReg._balBits, last[2], state[2])))
+        self.db.executemany('INSERT INTO events (pack, ts, kind, raw, detail) VALUES (?, ?, ?, ?, ?)',
+                            [(pack, t, *e) for e in events])
+
+    def tell(self):
+        return 0 # SQLite logs are not rotated
+
+    def flush(self):
+        if self.inTransaction:
+            self.db.execute('COMMIT')
+            self.inTransaction = False
+
+    def close(self):
+        if self.db is None: return
+        self.flush()
+        self.db.close()
+        self.db = None
+
+def query(db, start = None, end = None, columns = ('ts',), pack = None):
+    '''return {column: list} from a SQLite log connection for samples with
+    start <= ts < end; columns are samples columns, 't' or cellN_mv'''
+    columns = list(columns)
+    def where(prefix = ''):
+        where, args = ['1'], []
+        if pack is not None: where.append(f'{prefix}pack = ?'); args.append(str(pack))
+        if start is not None: where.append(f'{prefix}ts >= ?'); args.append(start)
+        if end is not None: where.append(f'{prefix}ts < ?'); args.append(end)
+        return ' AND '.join(where), args
+
+    cells = {int(n[4:-3]): n for n in columns if n.startswith('cell') and n.endswith('_mv')}
+    plain = [n for n in columns if n not in cells.values()]
+    for n in plain:
+        if n not in ('t', 'ts', 'mono', 'pack', *sampleColumns):
+            raise KeyError(n)
+    sel = ', '.join('ts' if n == 't' else n for n in ['id', *plain])
+    w, args = where()
+    rows = db.execute(f'SELECT {sel} FROM samples WHERE {w} ORDER BY ts, id', args).fetchall()
+    ret = {n: [r[i + 1] for r in rows] for i, n in enumerate(plain)}
+    if cells:
+        pos = {r[0]: i for i, r in enumerate(rows)}
+        for n in cells.values():
+            ret[n] = [None] * len(rows)
+        w, args = where('s.')
+        q = f'''SELECT c.sample, c.cell, c.mv FROM cells c JOIN samples s ON s.id = c.sample
+                WHERE {w} AND c.cell IN ({", ".join("?" * len(cells))})'''
+        for sample, cell, mv in db.execute(q, [*args, *cells]):
+            ret[cells[cell]][pos[sample]] = mv
+    return {n: ret[n] for n in columns}
+
+def samples(db, start = None, end = None, pack = None):
+    'yield (t, basicInfo, cellInfo, pack) from a SQLite log connection, oldest first'
+    where, args = ['1'], []
+    if pack is not None: where.append('pack = ?'); args.append(str(pack))
+    if start is not None: where.append('ts >= ?'); args.append(start)
+    if end is not None: where.append('ts < ?'); args.append(end)
+    rows = db.execute(f'''SELECT id, ts, pack, {", ".join(sampleColumns)} FROM samples
+                          WHERE {" AND ".join(where)} ORDER BY ts, id''', args)
+    for row in rows:
+        cells = db.execute('SELECT cell, mv FROM cells WHERE sample = ? ORDER BY cell', (row[0],))
+        cellInfo = {f'cell{cell}_mv': mv for cell, mv in cells}
+        basicInfo = BasicInfoReg.expand(dict(zip(sampleColumns, row[3:])))
+        basicInfo['cell_cnt'] = len(cellInfo)
+        yield row[1], basicInfo, cellInfo, row[2]
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+# BMS Tools
+# Copyright (C) 2020 Eric Poulsen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Incremental statistics over readBasicInfo() / readCellInfo() samples.
+#
+#   s = CellStats(window = 60)
+#   s.update(basicInfo, cellInfo)
+#   s.delta, s.imbalance.max, s.cells[3].std, s.recent[3].min
+#
+# Running keeps count/min/max/mean/variance since the last reset (Welford),
+# Rolling the same over the last 'window' seconds.  Every query is O(1);
+# update() is O(cells).
+
+import math
+import time
+from collections import deque
+
+__all__ = ['Running', 'Rolling', 'CellStats']
+
+class Running:
+    'count, min, max, mean and variance of everything add()ed'
+    __slots__ = ('n', 'mean', '_m2', 'min', 'max', 'last')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = None
+        self.max = None
+        self.last = None
+
+    def add(self, x):
+        self.n += 1
+        d = x - self.mean
+        self.mean += d / self.n
+        self._m2 += d * (x - self.mean)
+        if self.n == 1:
+            self.min = self.max = x
+        elif x < self.min:
+            self.min = x
+        elif x > self.max:
+            self.max = x
+        self.last = x
+
+    @property
+    def variance(self):
+        'sample variance; 0 for fewer than 2 values'
+        return self._m2 / (self.n - 1) if self.n > 1 else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}: n={self.n} min={self.min} max={self.max} mean={self.mean:.3f} std={self.std:.3f}>'
+
+class Rolling:
+    '''count, min, max, mean and variance of the values add()ed in the last
+    window seconds.  Sums are kept on add/expire and min/max in monotonic
+    deques, so both are amortised O(1).'''
+    __slots__ = ('window', '_values', '_mins', '_maxs', '_sum', '_sumSq')
+
+    def __init__(self, window):
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self._values = deque() # (t, x)
+        self._mins = deque()   # (t, x), x increasing
+        self._maxs = deque()   # (t, x), x decreasing
+        self._sum = 0
+        self._sumSq = 0
+
+    def add(self, x, t = None):
+        t = time.monotonic() if t is None else t
+        self._values.append((t, x))
+        self._sum += x
+        self._sumSq += x * x
+        while self._mins and self._mins[-1][1] >= x: self._mins.pop()
+        self._mins.append((t, x))
+        while self._maxs and self._maxs[-1][1] <= x: self._maxs.pop()
+        self._maxs.append((t, x))
+        self.expire(t)
+
+    def expire(self, now):
+        'drop values older than now - window'
+        cutoff = now - self.window
+        values = self._values
+        while values and values[0][0] <= cutoff:
+            _, x = values.popleft()
+            self._sum -= x
+            self._sumSq -= x * x
+        while self._mins and self._mins[0][0] <= cutoff: self._mins.popleft()
+        while self._maxs and self._maxs[0][0] <= cutoff: self._maxs.popleft()
+
+    @property
+    def n(self):
+        return len(self._values)
+
+    @property
+    def min(self):
+        return self._mins[0][1] if self._mins else None
+
+    @property
+    def max(self):
+        return self._maxs[0][1] if self._maxs else None
+
+    @property
+    def mean(self):
+        return self._sum / len(self._values) if self._values else 0.0
+
+    @property
+    def variance(self):
+        n = len(self._values)
+        if n < 2: return 0.0
+        # exact for integer samples (mV, mA); clamp float rounding
+        return max(0.0, (self._sumSq - self._sum * self._sum / n) / (n - 1))
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}: {self.window}s n={self.n} min={self.min} max={self.max} mean={self.mean:.3f}>'
+
+class CellStats:
+    '''per-cell and pack level statistics, fed one sample at a time.
+
+    After update(), min / max / avg / delta and minCell / maxCell describe
+    the latest sample (avg as integer mV, like the GUI shows it).  cells
+    and ntcs hold a Running per cell / NTC, recent a Rolling per cell;
+    imbalance, recentImbalance, packMv and packMa track the pack.'''
+    def __init__(self, window = 60):
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.samples = 0
+        self.cells = []
+        self.recent = []
+        self.ntcs = []
+        self.imbalance = Running()
+        self.recentImbalance = Rolling(self.window)
+        self.packMv = Running()
+        self.packMa = Running()
+        self.min = self.max = self.avg = self.delta = None
+        self.minCell = self.maxCell = None
+
+    def _grow(self, stats, n, factory):
+        while len(stats) < n:
+            stats.append(factory())
+
+    def update(self, basicInfo, cellInfo, t = None):
+        'add one sample; t defaults to time.monotonic().  Returns self.'
+        t = time.monotonic() if t is None else t
+        volts = [v for v in cellInfo.values() if v is not None]
+        if volts:
+            self._grow(self.cells, len(volts), Running)
+            self._grow(self.recent, len(volts), lambda: Rolling(self.window))
+            for running, rolling, v in zip(self.cells, self.recent, volts):
+                running.add(v)
+                rolling.add(v, t)
+            self.min, self.max = min(volts), max(volts)
+            self.minCell, self.maxCell = volts.index(self.min), volts.index(self.max)
+            self.avg = sum(volts) // len(volts)
+            self.delta = self.max - self.min
+            self.imbalance.add(self.delta)
+            self.recentImbalance.add(self.delta, t)
+
+        if basicInfo:
+            temps = [basicInfo.get(f'ntc{i}') for i in range(basicInfo.get('ntc_cnt', 0))]
+            self._grow(self.ntcs, len(temps), Running)
+            for running, v in zip(self.ntcs, temps):
+                if v is not None: running.add(v)
+            if basicInfo.get('pack_mv') is not None: self.packMv.add(basicInfo['pack_mv'])
+            if basicInfo.get('pack_ma') is not None: self.packMa.add(basicInfo['pack_ma'])
+        self.samples += 1
+        return self
+
+    def summary(self):
+        'return a flat dict of the current figures'
+        ret = {
+            'samples': self.samples,
+            'cell_min_mv': self.min, 'cell_max_mv': self.max,
+            'cell_avg_mv': self.avg, 'cell_delta_mv': self.delta,
+            'delta_max_mv': self.imbalance.max, 'delta_mean_mv': self.imbalance.mean,
+            'delta_recent_max_mv': self.recentImbalance.max,
+            'pack_mv_mean': self.packMv.mean, 'pack_ma_mean': self.packMa.mean,
+            'pack_ma_min': self.packMa.min, 'pack_ma_max': self.packMa.max,
+        }
+        for i, c in enumerate(self.cells):
+            ret[f'cell{i}_mean_mv'] = c.mean
+            ret[f'cell{i}_std_mv'] = c.std
+        for i, c in enumerate(self.ntcs):
+            ret[f'ntc{i}_min'] = c.min
+            ret[f'ntc{i}_max'] = c.max
+        return ret
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}: {self.samples} samples, {len(self.cells)} cells, delta {self.delta}>'
@@ -42,6 +42,9 @@ import wx.html2
 import bmstools
 import bmstools.jbd as jbd
 from bmstools.jbd.logging import Logger
+from bmstools.jbd.capture import FrameCapture
+from bmstools.jbd.replay import Replayer
+from bmstools.jbd.stats import CellStats
 
 appName = 'JBD BMS Tools'
 appVersion = bmstools.version
@@ -259,6 +262,85 @@ class DebugWindow(wx.Frame):
 
     write = stdout
 
+class ReplayWindow(wx.Frame):
+    'position, speed and display rate controls for a running replay'
+    speeds = (('1x', 1), ('10x', 10), ('100x', 100), ('As fast as possible', 0))
+    steps = 1000 # slider resolution
+
+    def __init__(self, parent, replayer, worker, **kwargs):
+        super().__init__(parent, title = f'Replay: {os.path.basename(replayer.fn)}', **kwargs)
+        self.replayer = replayer
+        self.worker = worker
+        self.gap = worker.replay_gap
+        self.first, self.last = replayer.span()
+        self.dragging = False
+
+        vbox = wx.BoxSizer(wx.VERTICAL)
+        self.posText = wx.StaticText(self, label = self._label(self.first) or 'no samples', size = (200, -1))
+        self.slider = wx.Slider(self, value = 0, minValue = 0, maxValue = self.steps, size = (400, -1))
+        self.slider.Enable(self.first is not None and self.last > self.first)
+        vbox.Add(self.posText, 0, wx.ALL, 5)
+        vbox.Add(self.slider, 0, wx.EXPAND | wx.LEFT | wx.RIGHT, 5)
+
+        hbox = wx.BoxSizer()
+        self.speedChoice = wx.Choice(self, choices = [n for n, _ in self.speeds])
+        self.speedChoice.SetSelection(next((i for i, (_, s) in enumerate(self.speeds) if s == replayer.speed), 0))
+        self.limitBox = wx.CheckBox(self, label = 'Limit display updates')
+        self.limitBox.SetValue(bool(self.gap))
+        self.limitBox.Enable(bool(self.gap))
+        stopButton = wx.Button(self, label = 'Stop')
+        hbox.Add(wx.StaticText(self, label = 'Speed'), 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, 5)
+        hbox.Add(self.speedChoice, 0, wx.ALL, 5)
+        hbox.Add(self.limitBox, 0, wx.ALIGN_CENTER_VERTICAL | wx.ALL, 5)
+        hbox.Add(stopButton, 0, wx.ALL, 5)
+        vbox.Add(hbox)
+        self.SetSizerAndFit(vbox)
+
+        self.speedChoice.Bind(wx.EVT_CHOICE, self.onSpeed)
+        self.limitBox.Bind(wx.EVT_CHECKBOX, self.onLimit)
+        stopButton.Bind(wx.EVT_BUTTON, lambda evt: self.Close())
+        self.slider.Bind(wx.EVT_SCROLL_THUMBTRACK, self.onTrack)
+        self.slider.Bind(wx.EVT_SCROLL_THUMBRELEASE, self.onSeek)
+        self.slider.Bind(wx.EVT_SCROLL_CHANGED, self.onSeek)
+        self.Bind(wx.EVT_CLOSE, self.onClose)
+        self.timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.onTimer)
+        self.timer.Start(250)
+
+    def _time(self, value):
+        return self.first + (self.last - self.first) * value / self.steps
+
+    def _label(self, t):
+        if t is None: return ''
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t))
+
+    def onTimer(self, evt):
+        t = self.replayer.position
+        if t is None or self.dragging: return
+        if self.slider.IsEnabled():
+            self.slider.SetValue(round((t - self.first) / (self.last - self.first) * self.steps))
+        self.posText.SetLabel(self._label(t))
+
+    def onTrack(self, evt):
+        self.dragging = True
+        self.posText.SetLabel(self._label(self._time(self.slider.GetValue())))
+
+    def onSeek(self, evt):
+        self.dragging = False
+        self.replayer.seek(self._time(self.slider.GetValue()))
+
+    def onSpeed(self, evt):
+        self.replayer.speed = self.speeds[self.speedChoice.GetSelection()][1]
+
+    def onLimit(self, evt):
+        # unlimited lets a fast replay load-test the display path
+        self.worker.replay_gap = self.gap if self.limitBox.GetValue() else None
+
+    def onClose(self, evt):
+        self.timer.Stop()
+        self.Parent.replayWindowClosed(self)
+        self.Destroy()
+
 # we have to do all this convoluted writing
 # via events else `print` statements from 
 # background threads will clog up the works.
@@ -1412,6 +1494,7 @@ class Main(wx.Frame):
         self.sys_stderr = sys.stderr
 
         self.logger = None
+        self.replayWindow = None
 
         # plugins
         self.loadPlugins()
@@ -1446,6 +1529,7 @@ class Main(wx.Frame):
         self.j = jbd.JBD(port)
         self.accessLock = LockClass()
         self.worker = BkgWorker(self, self.j)
+        self.cellStats = CellStats()
 
         font = wx.Font(8, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_NORMAL)
         self.SetFont(font)
@@ -1458,6 +1542,7 @@ class Main(wx.Frame):
         self.debugWindowItem = self.fileMenu.Append(wx.ID_ANY, 'Debug Window', 'Show debug window', kind = wx.ITEM_CHECK)
         self.aboutItem = self.fileMenu.Append(wx.ID_ABOUT, 'About', f'About {appName}')
         self.websiteItem = self.fileMenu.Append(wx.ID_ANY, f'{appName} website', f'{appName} website')
+        self.replayItem = self.fileMenu.Append(wx.ID_ANY, 'Replay Log...', 'Play a recorded log or capture through the display')
 
         for n,m in self.plugins.items():
             try:
@@ -1482,6 +1567,7 @@ class Main(wx.Frame):
         self.Bind(wx.EVT_MENU, self.onDebugWindowToggle, self.debugWindowItem)
         self.Bind(wx.EVT_MENU, self.onWebsite, self.websiteItem)
         self.Bind(wx.EVT_MENU, self.onAbout, self.aboutItem)
+        self.Bind(wx.EVT_MENU, self.onReplay, self.replayItem)
         self.Bind(wx.EVT_MENU, self.onQuit, self.quitItem)
 
         layout = LayoutGen(self)
@@ -1563,6 +1649,7 @@ class Main(wx.Frame):
         self.Bind(BkgWorker.EVT_EEP_PROG, self.onProgress)
         self.Bind(BkgWorker.EVT_EEP_DONE, self.onEepromDone)
         self.Bind(BkgWorker.EVT_SCAN_DATA, self.onScanData)
+        self.Bind(BkgWorker.EVT_REPLAY_DONE, self.onReplayDone)
         self.Bind(BkgWorker.EVT_CAL_DONE, self.onCalDone)
         self.Bind(wx.EVT_BUTTON, self.onButtonClick)
         self.Bind(wx.EVT_CLOSE, self.onClose)
@@ -1714,7 +1801,9 @@ class Main(wx.Frame):
 
         self.setStatus('')
 
-        self.logData(evt.basicInfo, evt.cellInfo)
+        # replayed samples are history; they don't belong in a live log
+        if not getattr(evt, 'replayed', False):
+            self.logData(evt.basicInfo, evt.cellInfo)
 
         #sometimes we get data after stopping ...
         if self.worker.scanRunning:
@@ -1723,6 +1812,7 @@ class Main(wx.Frame):
         temps = [v for k,v in evt.basicInfo.items() if self.ntc_RE.match(k) and v is not None]
         bals  = [v for k,v in evt.basicInfo.items() if k.startswith('bal') and v is not None]
         volts = [v for v in evt.cellInfo.values() if v is not None]
+        stats = self.cellStats.update(evt.basicInfo, evt.cellInfo)
 
         # send data to any open plugins
 
@@ -1755,16 +1845,13 @@ class Main(wx.Frame):
         for i,t in enumerate(temps):
             self.set(f'cal_ntc_read{i}', t)
 
-        cell_max_mv = max(volts)
-        cell_min_mv = min(volts)
-        cell_delta_mv = cell_max_mv - cell_min_mv
         self.set('info_pack_mv', evt.basicInfo['pack_mv'])
         self.set('info_pack_ma', evt.basicInfo['pack_ma'])
         self.set('cal_pack_ma', evt.basicInfo['pack_ma'])
-        self.set('info_cell_avg_mv', sum(volts) // len(volts))
-        self.set('info_cell_max_mv', cell_max_mv)
-        self.set('info_cell_min_mv', cell_min_mv)
-        self.set('info_cell_delta_mv', cell_delta_mv)
+        self.set('info_cell_avg_mv', stats.avg)
+        self.set('info_cell_max_mv', stats.max)
+        self.set('info_cell_min_mv', stats.min)
+        self.set('info_cell_delta_mv', stats.delta)
         self.set('info_cycle_cnt', evt.basicInfo['cycle_cnt'])
         self.set('info_full_cap', evt.basicInfo['full_cap'])
         self.set('info_cur_cap', evt.basicInfo['cur_cap'])
@@ -1900,16 +1987,54 @@ class Main(wx.Frame):
         if self.worker.scanRunning:
             self.startStopScanButton.Enable(False)
             self.worker.stopScan()
+            if self.replayWindow:
+                self.replayWindow.Close()
             self.startStopScanButton.SetLabel('Start Scan')
             self.startStopScanButton.Enable(True)
             self.progressGauge.SetValue(0)
         else:
             self.startStopScanButton.Enable(False)
+            self.cellStats.reset()
             self.worker.startScan()
             self.startStopScanButton.SetLabel('Stop Scan')
             self.startStopScanButton.Enable(True)
             self.progressGauge.Pulse()
 
+    def onReplay(self, evt):
+        with wx.FileDialog(self, 'Replay Log', wildcard='Logs (*.csv;*.jbl;*.jbc;*.sqlite;*.db)|*.csv;*.jbl;*.jbc;*.sqlite;*.sqlite3;*.db|All files (*.*)|*.*',
+                           style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST) as fileDialog:
+            if fileDialog.ShowModal() == wx.ID_CANCEL: return
+            fn = fileDialog.GetPath()
+        if self.worker.scanRunning:
+            self.startStopScan()
+        try:
+            self.cellStats.reset()
+            replayer = Replayer(fn)
+            self.replayWindow = ReplayWindow(self, replayer, self.worker)
+            self.worker.startReplay(replayer)
+        except:
+            traceback.print_exc()
+            wx.LogError(f'Cannot replay "{fn}".')
+            if self.replayWindow: self.replayWindow.Close()
+            return
+        if self.icon: self.replayWindow.SetIcon(self.icon)
+        self.replayWindow.Show()
+        self.startStopScanButton.SetLabel('Stop Scan')
+        self.progressGauge.Pulse()
+        self.setStatus('Replay')
+
+    def onReplayDone(self, evt):
+        if self.worker.replayer is evt.replayer and self.worker.scanRunning:
+            self.startStopScan()
+            self.setStatus('Replay done')
+
+    def replayWindowClosed(self, window):
+        'called by ReplayWindow as it closes; stops its replay if still running'
+        if self.replayWindow is not window: return
+        self.replayWindow = None
+        if self.worker.replayer is window.replayer and self.worker.scanRunning:
+            self.startStopScan()
+
     def voltNtcCal(self):
         try:
             data = self.gatherCal()
@@ -2110,14 +2235,17 @@ class Main(wx.Frame):
 
     def startStopLog(self):
         if not self.logger:
-            with wx.FileDialog(self, 'Log Data', wildcard='Data files (*.xlsx)|*.xlsx|CSV files (*.csv)|*.csv|All files (*.*)|*.*',
+            with wx.FileDialog(self, 'Log Data', wildcard='Data files (*.xlsx)|*.xlsx|CSV files (*.csv)|*.csv|Binary logs (*.jbl)|*.jbl|Raw frame captures (*.jbc)|*.jbc|All files (*.*)|*.*',
                             style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT) as fileDialog:
 
                 if fileDialog.ShowModal() == wx.ID_CANCEL: return
                 try:
                     fn = fileDialog.GetPath()
                     if '.' not in fn: fn += '.xlsx'
-                    self.logger = Logger(fn)
+                    if fn.lower().endswith('.jbc'):
+                        self.logger = FrameCapture(fn).attach(self.j)
+                    else:
+                        self.logger = Logger(fn)
                     self.startStopLogButton.SetLabel('Stop Log')
                 except:
                     traceback.print_exc()
@@ -2128,7 +2256,8 @@ class Main(wx.Frame):
             self.startStopLogButton.SetLabel('Start Log')
 
     def logData(self, *args, **kwargs):
-        if self.logger:
+        # a FrameCapture records frames as they are read, not samples
+        if self.logger and not isinstance(self.logger, FrameCapture):
             self.logger.log(*args, **kwargs)
 
     def clearErrors(self):
@@ -2153,6 +2282,7 @@ class BkgWorker:
     EepDone, EVT_EEP_DONE = wx.lib.newevent.NewEvent()
     ScanData, EVT_SCAN_DATA = wx.lib.newevent.NewEvent()
     CalDone, EVT_CAL_DONE = wx.lib.newevent.NewEvent()
+    ReplayDone, EVT_REPLAY_DONE = wx.lib.newevent.NewEvent()
 
     def __init__(self, parent, jbd):
         self.parent = parent
@@ -2161,6 +2291,8 @@ class BkgWorker:
         self.scan_thread = None
         self.scan_run = False
         self.scan_delay = 1
+        self.replayer = None
+        self.replay_gap = .02 # min seconds between replayed samples, so the GUI keeps up; None for no limit
 
     def progress(self, value):
         wx.PostEvent(self.parent, self.EepProg(value = value))
@@ -2251,6 +2383,32 @@ class BkgWorker:
         finally:
             print('scan terminated')
     
+    def replayWorker(self, replayer):
+        last = 0
+        def post(t, basicInfo, cellInfo, deviceInfo):
+            nonlocal last
+            if self.replay_gap:
+                delay = last + self.replay_gap - time.monotonic()
+                if delay > 0: time.sleep(delay)
+                last = time.monotonic()
+            wx.PostEvent(self.parent, self.ScanData(basicInfo = basicInfo, cellInfo = cellInfo, deviceInfo = deviceInfo, replayed = True))
+        try:
+            print(f'replay start {replayer.fn}')
+            replayer.run(post)
+        except Exception as e:
+            wx.PostEvent(self.parent, self.ScanData(err = e))
+        finally:
+            print('replay terminated')
+            wx.PostEvent(self.parent, self.ReplayDone(replayer = replayer))
+
+    def startReplay(self, replayer):
+        'play replayer into the scan display; stopScan() stops it'
+        if self.scan_thread: return
+        self.replayer = replayer
+        self.scan_thread = threading.Thread(target = self.replayWorker, args = (replayer,))
+        self.scan_run = True
+        self.scan_thread.start()
+
     def startScan(self):
         if self.scan_thread: return
         self.scan_thread = threading.Thread(target = self.scanWorker)
@@ -2260,6 +2418,9 @@ class BkgWorker:
     def stopScan(self):
         if not self.scan_thread: return
         self.scan_run = False
+        if self.replayer:
+            self.replayer.stop()
+            self.replayer = None
         self.scan_thread.join(3)
         ret = not self.scan_thread.is_alive()
         self.scan_thread = None
@@ -38,7 +38,8 @@ setup(
     cmdclass=versioneer.get_cmdclass(),
     install_requires=['pyserial~=3.4', 'xlsxwriter==1.3.7'],
     extras_require = {
-        'gui': ['wxPython~=4.1.1', 'pyinstaller']
+        'gui': ['wxPython~=4.1.1', 'pyinstaller'],
+        'numpy': ['numpy'],
     },
     license='Creative Commons Attribution-Noncommercial-Share Alike license',
     packages=find_packages(),